@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark the dense retrieval engines: ChromaDB (HNSW) vs the in-process exact index
+
+Both engines answer the same top-k queries. The script reports single-query latency
+(mean/p50/p95), batched throughput, and ChromaDB's recall@k against the exact results.
+Query vectors are stored chunk embeddings with a little noise added, so the embedding
+model is not loaded and is not part of the timings.
+
+Usage:
+    python3 benchmark_search.py --queries 500 --k 5   # the KB at CHROMA_DB_PATH
+    python3 benchmark_search.py --synthetic 5000     # random 384-dim KB in a temp directory
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+def percentile(samples, q):
+    return float(np.percentile(samples, q)) if samples else 0.0
+
+
+def time_single(query_fn, query_vectors, k):
+    """Per-query latencies in ms"""
+    latencies = []
+    for vector in query_vectors:
+        started = time.perf_counter()
+        query_fn([vector], k)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def time_batch(query_fn, query_vectors, k, batch_size):
+    """Queries per second when sent batch_size at a time"""
+    started = time.perf_counter()
+    for start in range(0, len(query_vectors), batch_size):
+        query_fn(query_vectors[start:start + batch_size], k)
+    return len(query_vectors) / (time.perf_counter() - started)
+
+
+def load_synthetic(collection, count, dim, seed):
+    """Fill a collection with random unit vectors in batched writes"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, count, 1000):
+        size = min(1000, count - start)
+        vectors = rng.standard_normal((size, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.add(
+            ids=[f"synthetic-{start + i}" for i in range(size)],
+            embeddings=vectors.tolist(),
+            documents=[f"synthetic chunk {start + i}" for i in range(size)],
+            metadatas=[{"category": "AB"[(start + i) % 2], "chunk_index": start + i} for i in range(size)]
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ChromaDB vs exact in-process dense search")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=5, help="Results per query")
+    parser.add_argument("--batch-size", type=int, default=32, help="Queries per call for the throughput run")
+    parser.add_argument("--noise", type=float, default=0.05, help="Noise added to sampled chunk embeddings")
+    parser.add_argument("--category", help="Also filter both engines by this category")
+    parser.add_argument("--synthetic", type=int, help="Benchmark a temporary KB of this many random chunks")
+    parser.add_argument("--dim", type=int, default=384, help="Embedding size for --synthetic")
+    parser.add_argument("--chroma-db-path", help="Override CHROMA_DB_PATH")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.TemporaryDirectory() if args.synthetic else None
+    if tmp_dir:
+        os.environ["CHROMA_DB_PATH"] = tmp_dir.name
+    elif args.chroma_db_path:
+        os.environ["CHROMA_DB_PATH"] = str(Path(args.chroma_db_path).resolve())
+
+    import main as rag
+    rag.init_vector_store()
+    collection = rag.kb_collection
+    if args.synthetic:
+        print(f"🧪 Loading {args.synthetic} synthetic {args.dim}-dim chunks...")
+        load_synthetic(collection, args.synthetic, args.dim, args.seed)
+    if collection.count() == 0:
+        sys.exit(f"❌ Knowledge base at {rag.CHROMA_DB_PATH} is empty (use --synthetic N)")
+
+    started = time.perf_counter()
+    exact = rag.ExactSearchIndex(tmp_dir.name if tmp_dir else None)
+    exact.rebuild(collection)
+    print(f"🧮 Exact index: {exact.stats()['chunks']} chunks loaded in {time.perf_counter() - started:.2f}s")
+
+    # Queries: stored chunk embeddings plus noise (no embedding model needed)
+    rng = np.random.default_rng(args.seed)
+    rows = rng.choice(exact.stats()["chunks"], size=args.queries, replace=True)
+    query_vectors = np.asarray(exact.vectors[rows]) + rng.normal(0, args.noise, (args.queries, exact.vectors.shape[1]))
+    query_vectors = query_vectors.astype(np.float32).tolist()
+
+    where = {"category": args.category} if args.category else None
+    engines = {
+        "chroma": lambda vectors, k: collection.query(
+            query_embeddings=vectors, n_results=k, **({"where": where} if where else {})
+        ),
+        "exact": lambda vectors, k: exact.query(vectors, k, where=where),
+    }
+
+    # Warm both paths (HNSW index load, page cache)
+    for query_fn in engines.values():
+        query_fn(query_vectors[:1], args.k)
+
+    print(f"\n{args.queries} queries, k={args.k}{f', category={args.category}' if where else ''}")
+    print(f"{'engine':<8} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'batch q/s':>11}")
+    for name, query_fn in engines.items():
+        latencies = time_single(query_fn, query_vectors, args.k)
+        throughput = time_batch(query_fn, query_vectors, args.k, args.batch_size)
+        print(
+            f"{name:<8} {np.mean(latencies):>9.3f} {percentile(latencies, 50):>9.3f} "
+            f"{percentile(latencies, 95):>9.3f} {throughput:>11.0f}"
+        )
+
+    chroma_ids = engines["chroma"](query_vectors, args.k)["ids"]
+    exact_ids = engines["exact"](query_vectors, args.k)["ids"]
+    hits = sum(len(set(c) & set(e)) for c, e in zip(chroma_ids, exact_ids))
+    total = sum(len(e) for e in exact_ids) or 1
+    print(f"\nChromaDB recall@{args.k} vs exact: {hits / total:.3f}")
+
+    if tmp_dir:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
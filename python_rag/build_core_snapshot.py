@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""
+Build the core KB embedding snapshot (core_kb_snapshot.npz) next to main.py
+
+Run at image build time so a fresh container bootstraps an empty knowledge base with a
+single bulk write instead of running the embedding model. The snapshot records a model
+fingerprint; main.py re-encodes instead of using it if the fingerprint does not match.
+"""
+
+import main
+
+model = main.load_embedding_model(main.EMBEDDING_BACKEND)
+result = main.build_core_snapshot(model, main.EMBEDDING_BACKEND)
+
+print(f"✅ Core KB snapshot written: {result['path']} ({result['documents']} documents, dim {result['dimension']})")
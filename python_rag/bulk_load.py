@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Bulk-load a directory or zip archive of PDF/DOCX/RTF/TXT files into the knowledge base
+
+Files are read, hashed and extracted in parallel worker processes, then chunked,
+batch-embedded and batch-written into the ChromaDB at CHROMA_DB_PATH. Each file is ingested with its
+relative path as the source_key, so re-running after edits only re-embeds changed chunks.
+Progress is recorded in a state file after every file; a re-run after a crash skips
+files that were already loaded.
+
+Usage:
+    python3 bulk_load.py /path/to/guides --category Tax
+    python3 bulk_load.py ato_library.zip --workers 4 --chroma-db-path ./chroma_db
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.rtf', '.txt')
+
+
+def list_sources(source: Path):
+    """List (relative name, location) pairs for supported files in a directory or zip"""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            names = [
+                info.filename for info in archive.infolist()
+                if not info.is_dir()
+                and info.filename.lower().endswith(SUPPORTED_EXTENSIONS)
+                and not info.filename.startswith('__MACOSX/')
+                and not Path(info.filename).name.startswith('.')
+            ]
+        return [(name, (str(source), name)) for name in sorted(names)]
+
+    files = [
+        path for path in source.rglob('*')
+        if path.is_file()
+        and path.name.lower().endswith(SUPPORTED_EXTENSIONS)
+        and not path.name.startswith('.')
+    ]
+    return [(path.relative_to(source).as_posix(), (str(path), None)) for path in sorted(files)]
+
+
+# Archives opened by this (worker) process, kept open for the rest of the run
+open_archives = {}
+
+
+def read_file(location):
+    """Return (filename, bytes) for a directory file or zip member"""
+    path, member = location
+    if member is None:
+        return Path(path).name, Path(path).read_bytes()
+    archive = open_archives.get(path)
+    if archive is None:
+        archive = open_archives[path] = zipfile.ZipFile(path)
+    return Path(member).name, archive.read(member)
+
+
+def extract_file(location, loaded_hash=None):
+    """Worker: read and hash one file, then extract its text segments with main's extractors
+    
+    Returns (filename, file_hash, segments, extract_ms); segments is None when the file's
+    hash matches loaded_hash (already loaded by a previous run).
+    """
+    filename, file_bytes = read_file(location)
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    if file_hash == loaded_hash:
+        return filename, file_hash, None, 0.0
+
+    import main
+
+    # Already running in a worker process - extract PDF pages serially here
+    main.PDF_EXTRACT_WORKERS = 1
+
+    started = time.perf_counter()
+    try:
+        segments = main.extract_segments(filename.lower(), file_bytes)
+    except Exception as e:
+        raise RuntimeError(getattr(e, 'detail', str(e)))
+    extract_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    return filename, file_hash, segments, extract_ms
+
+
+def load_state(path: Path):
+    if path.exists():
+        return json.loads(path.read_text())
+    return {}
+
+
+def save_state(path: Path, state):
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    tmp_path.write_text(json.dumps(state, indent=2))
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load documents into the FDC Luna knowledge base")
+    parser.add_argument("source", help="Directory or .zip archive of PDF/DOCX/RTF/TXT files")
+    parser.add_argument("--category", default="General", help="Category for all loaded documents")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Extraction worker processes")
+    parser.add_argument("--key-prefix", default="", help="Prefix added to each file's source_key")
+    parser.add_argument("--chroma-db-path", help="Override CHROMA_DB_PATH")
+    parser.add_argument("--state", help="Resume state file (default: <chroma db>/bulk_load_state.json)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the resume state and reprocess every file")
+    args = parser.parse_args()
+
+    source = Path(args.source).resolve()
+    if not source.exists():
+        sys.exit(f"❌ Source not found: {source}")
+
+    if args.chroma_db_path:
+        os.environ["CHROMA_DB_PATH"] = str(Path(args.chroma_db_path).resolve())
+
+    import main as rag
+    rag.initialize_services()
+    if not rag.services_ready.is_set():
+        sys.exit(f"❌ Start-up failed: {rag.startup_state}")
+
+    state_path = Path(args.state) if args.state else Path(rag.CHROMA_DB_PATH) / "bulk_load_state.json"
+    state = {} if args.restart else load_state(state_path)
+
+    totals = {"loaded": 0, "unchanged": 0, "failed": 0, "chunks_created": 0, "chunks_reused": 0, "chunks_deleted": 0}
+
+    sources = list_sources(source)
+    print(f"📂 {len(sources)} supported files in {source}")
+    started = time.perf_counter()
+
+    # Workers hash each file and skip extraction when the bytes match the state recorded
+    # by a previous (possibly interrupted) run
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=rag.worker_mp_context()) as executor:
+        futures = {}
+        for name, location in sources:
+            source_key = f"{args.key_prefix}{name}"
+            futures[executor.submit(extract_file, location, state.get(source_key))] = source_key
+        for future in as_completed(futures):
+            source_key = futures[future]
+            try:
+                filename, file_hash, segments, extract_ms = future.result()
+            except Exception as e:
+                totals["failed"] += 1
+                print(f"  ❌ {source_key}: {e}")
+                continue
+            if segments is None:
+                totals["unchanged"] += 1
+                continue
+
+            try:
+                result = rag.ingest_text(
+                    title=filename,
+                    content=segments,
+                    category=args.category,
+                    metadata={"filename": filename},
+                    timings={"extract": extract_ms},
+                    source_key=source_key
+                )
+            except Exception as e:
+                totals["failed"] += 1
+                print(f"  ❌ {source_key}: {e}")
+                continue
+
+            state[source_key] = file_hash
+            save_state(state_path, state)
+
+            totals["unchanged" if result["status"] == "unchanged" else "loaded"] += 1
+            for field in ("chunks_created", "chunks_reused", "chunks_deleted"):
+                totals[field] += result[field]
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"\n{'⚠️' if totals['failed'] else '✅'} Bulk load finished in {elapsed:.1f}s: {totals['loaded']} loaded, "
+        f"{totals['unchanged']} unchanged, {totals['failed']} failed | "
+        f"chunks: {totals['chunks_created']} new, {totals['chunks_reused']} reused, {totals['chunks_deleted']} deleted"
+    )
+    if totals["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
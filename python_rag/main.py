@@ -7,20 +7,36 @@ Deployable as standalone FastAPI app on DigitalOcean App Platform.
 Run command: uvicorn main:app --host 0.0.0.0 --port $PORT
 """
 
+import asyncio
+import atexit
 import os
+import sys
+import re
+import time
+import hashlib
+import sqlite3
+import tempfile
 import uuid
+import threading
+import multiprocessing
+import weakref
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from typing import List, Dict, Any, Optional, Callable, Iterable, Union, Tuple, Literal
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
 import requests
+import httpx
 from pypdf import PdfReader
 from docx import Document
 from striprtf.striprtf import rtf_to_text
+import numpy as np
 import json
 
 # Initialize FastAPI
@@ -227,53 +243,578 @@ def initialize_knowledge_base():
     if doc_count == 0:
         print("📚 Knowledge base is empty. Loading core FDC Tax documents...")
         
-        for doc in CORE_KB_DOCUMENTS:
-            try:
-                # Generate embedding
-                embedding = embedding_model.encode(doc["content"]).tolist()
-                
-                # Add to collection
-                kb_collection.add(
-                    ids=[doc["id"]],
-                    embeddings=[embedding],
-                    documents=[doc["content"]],
-                    metadatas=[{
-                        "title": doc["title"],
-                        "doc_id": doc["id"],
-                        "source": "core_kb",
-                        "type": "reference"
-                    }]
-                )
+        try:
+            embeddings = core_kb_embeddings()
+            
+            # Single bulk write for all core documents
+            kb_collection.add(
+                ids=[doc["id"] for doc in CORE_KB_DOCUMENTS],
+                embeddings=embeddings,
+                documents=[doc["content"] for doc in CORE_KB_DOCUMENTS],
+                metadatas=[{
+                    "title": doc["title"],
+                    "doc_id": doc["id"],
+                    "source": "core_kb",
+                    "type": "reference"
+                } for doc in CORE_KB_DOCUMENTS]
+            )
+            for doc in CORE_KB_DOCUMENTS:
                 print(f"  ✅ Loaded: {doc['title']}")
-            except Exception as e:
-                print(f"  ❌ Error loading {doc['title']}: {e}")
+        except Exception as e:
+            print(f"  ❌ Error loading core documents: {e}")
+            raise
         
         print(f"📚 Core knowledge base initialized with {len(CORE_KB_DOCUMENTS)} documents")
     else:
         print(f"📚 Knowledge base ready with {doc_count} document chunks")
+    
+    # Record the change marker before reading the KB, so writes made by other processes
+    # while the indexes build are picked up by the next sync
+    sync_kb_changes()
+    build_search_indexes()
+
+# Core KB embedding snapshot (built by build_core_snapshot.py)
+CORE_KB_SNAPSHOT_PATH = os.getenv("CORE_KB_SNAPSHOT_PATH", str(BASE_DIR / "core_kb_snapshot.npz"))
+SNAPSHOT_PROBE_TEXT = "FDC Luna embedding fingerprint probe"
+
+def embedding_fingerprint(model, backend: str) -> Dict[str, Any]:
+    """Identify the embedding model: name, backend and the vector of a fixed probe sentence"""
+    probe = np.asarray(model.encode([SNAPSHOT_PROBE_TEXT]), dtype=np.float32)[0]
+    return {"model": EMBEDDING_MODEL_NAME, "backend": backend, "dimension": int(probe.shape[0]), "probe": probe.tolist()}
+
+def fingerprints_match(saved: Dict[str, Any], current: Dict[str, Any]) -> bool:
+    """Same model, backend (quantization changes vectors) and dimension, with a matching probe vector"""
+    if any(saved.get(field) != current[field] for field in ("model", "backend", "dimension")):
+        return False
+    saved_probe = np.asarray(saved.get("probe", []), dtype=np.float32)
+    current_probe = np.asarray(current["probe"], dtype=np.float32)
+    if saved_probe.shape != current_probe.shape:
+        return False
+    cosine = float(saved_probe @ current_probe / (np.linalg.norm(saved_probe) * np.linalg.norm(current_probe) + 1e-12))
+    return cosine >= 0.9999
+
+def build_core_snapshot(model, backend: str, path: str = CORE_KB_SNAPSHOT_PATH) -> Dict[str, Any]:
+    """Encode CORE_KB_DOCUMENTS and save embeddings + model fingerprint as a compressed .npz"""
+    embeddings = np.asarray(
+        model.encode([doc["content"] for doc in CORE_KB_DOCUMENTS], batch_size=EMBED_BATCH_SIZE),
+        dtype=np.float32
+    )
+    fingerprint = embedding_fingerprint(model, backend)
+    np.savez_compressed(
+        path,
+        ids=np.array([doc["id"] for doc in CORE_KB_DOCUMENTS]),
+        content_hashes=np.array([content_hash(doc["content"]) for doc in CORE_KB_DOCUMENTS]),
+        embeddings=embeddings,
+        fingerprint=np.array(json.dumps(fingerprint))
+    )
+    return {"path": path, "documents": len(CORE_KB_DOCUMENTS), "dimension": fingerprint["dimension"]}
 
-# Initialize ChromaDB with persistent client
-print(f"Initializing ChromaDB at: {CHROMA_DB_PATH}")
-chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+def core_kb_embeddings() -> List[List[float]]:
+    """Embeddings for CORE_KB_DOCUMENTS, from the snapshot where it is valid for the current model
+    
+    Documents whose content changed since the snapshot was built, or every document if the
+    model fingerprint differs, are re-encoded in one batch.
+    """
+    snapshot_vectors: Dict[str, np.ndarray] = {}
+    if os.path.exists(CORE_KB_SNAPSHOT_PATH):
+        try:
+            with np.load(CORE_KB_SNAPSHOT_PATH, allow_pickle=False) as snapshot:
+                fingerprint = json.loads(str(snapshot["fingerprint"]))
+                if fingerprints_match(fingerprint, embedding_fingerprint(embedding_model, embedding_backend)):
+                    for doc_id, doc_hash, vector in zip(
+                        snapshot["ids"], snapshot["content_hashes"], snapshot["embeddings"]
+                    ):
+                        snapshot_vectors[f"{doc_id}:{doc_hash}"] = vector
+                else:
+                    print(
+                        f"⚠️ Core KB snapshot was built with {fingerprint.get('model')}@{fingerprint.get('backend')}, "
+                        f"running {EMBEDDING_MODEL_NAME}@{embedding_backend} - re-encoding"
+                    )
+        except Exception as e:
+            print(f"⚠️ Could not read core KB snapshot ({e}) - re-encoding")
+    
+    keys = [f"{doc['id']}:{content_hash(doc['content'])}" for doc in CORE_KB_DOCUMENTS]
+    stale = [doc["content"] for doc, key in zip(CORE_KB_DOCUMENTS, keys) if key not in snapshot_vectors]
+    fresh = iter(embed_texts(stale))
+    if snapshot_vectors:
+        print(f"📦 Core KB snapshot: {len(CORE_KB_DOCUMENTS) - len(stale)} loaded, {len(stale)} re-encoded")
+    
+    return [
+        snapshot_vectors[key].tolist() if key in snapshot_vectors else next(fresh)
+        for key in keys
+    ]
+
+# Vector store, embedding model and cache are created by initialize_services() (see Startup below)
+chroma_client = None
+kb_collection = None
+embedding_model = None
+embedding_backend = None
+embedding_parity = None
+embedding_cache = None
+
+def init_vector_store():
+    """Open the persistent ChromaDB client and knowledge base collection"""
+    global chroma_client, kb_collection
+    import chromadb
+    
+    print(f"Initializing ChromaDB at: {CHROMA_DB_PATH}")
+    chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    
+    # Create or get collection
+    try:
+        kb_collection = chroma_client.get_or_create_collection(
+            name="fdc_knowledge_base",
+            metadata={"hnsw:space": "cosine"}
+        )
+    except Exception as e:
+        print(f"Error initializing ChromaDB: {e}")
+        kb_collection = chroma_client.create_collection(
+            name="fdc_knowledge_base",
+            metadata={"hnsw:space": "cosine"}
+        )
 
-# Create or get collection
-try:
-    kb_collection = chroma_client.get_or_create_collection(
-        name="fdc_knowledge_base",
-        metadata={"hnsw:space": "cosine"}
-    )
-except Exception as e:
-    print(f"Error initializing ChromaDB: {e}")
-    kb_collection = chroma_client.create_collection(
-        name="fdc_knowledge_base",
-        metadata={"hnsw:space": "cosine"}
+# Embedding configuration
+# EMBED_BATCH_SIZE: texts per model forward pass
+# EMBEDDING_CACHE_SIZE: vectors held in the in-memory LRU tier
+# EMBEDDING_CACHE_PATH: SQLite file for the persistent tier (empty string disables it)
+# EMBEDDING_CACHE_DISK_MAX: rows kept in the persistent tier, oldest-written evicted first (0 = unbounded)
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", str(BASE_DIR / "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_DISK_MAX = int(os.getenv("EMBEDDING_CACHE_DISK_MAX", "100000"))
+
+# Query embedding cache (normalized query text -> vector)
+# QUERY_CACHE_SIZE: cached queries; QUERY_CACHE_TTL: seconds before an entry expires (0 = never)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+
+# Embedding backend
+# EMBEDDING_BACKEND: torch (sentence-transformers), torch-int8 (dynamic int8 quantization),
+#                    onnx (ONNX Runtime) or onnx-int8 (ONNX Runtime, int8 weights - needs the onnx package)
+# EMBEDDING_ONNX_DIR: directory with model.onnx + tokenizer.json (defaults to ChromaDB's all-MiniLM-L6-v2 export)
+# EMBEDDING_PARITY_MIN: minimum cosine vs stored ChromaDB vectors for a non-torch backend to be used
+# EMBEDDING_PARITY_SAMPLES: stored chunks re-encoded for the parity check
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "")
+EMBEDDING_PARITY_MIN = float(os.getenv("EMBEDDING_PARITY_MIN", "0.99"))
+EMBEDDING_PARITY_SAMPLES = int(os.getenv("EMBEDDING_PARITY_SAMPLES", "32"))
+
+class OnnxEmbeddingBackend:
+    """Sentence embeddings on ONNX Runtime (mean pooling + L2 normalisation, matching sentence-transformers)
+    
+    Batches are padded to their longest input rather than the full 256-token window,
+    so short queries stay cheap.
+    """
+    
+    def __init__(self, model_dir: str, quantize: bool = False):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        
+        model_path = Path(model_dir) / "model.onnx"
+        if quantize:
+            model_path = self.quantize(model_path)
+        
+        self.tokenizer = Tokenizer.from_file(str(Path(model_dir) / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=256)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+    
+    @staticmethod
+    def quantize(model_path: Path) -> Path:
+        """Write (once) and return a dynamically int8-quantized copy of the model"""
+        quantized_path = model_path.with_name("model_int8.onnx")
+        if not quantized_path.exists():
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(str(model_path), str(quantized_path), weight_type=QuantType.QInt8)
+        return quantized_path
+    
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feed["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = self.session.run(None, feed)[0]
+            
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            batches.append((pooled / np.clip(norms, 1e-12, None)).astype(np.float32))
+        
+        vectors = np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+        return vectors[0] if single else vectors
+
+def chroma_onnx_model_dir() -> str:
+    """Directory of the all-MiniLM-L6-v2 ONNX export that ChromaDB downloads and verifies
+    
+    The download helper is private to chromadb, so fall back to embedding one text through the
+    public function (which downloads the model too) if it moves; set EMBEDDING_ONNX_DIR if the
+    export's location itself changes.
+    """
+    from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+    chroma_onnx = ONNXMiniLM_L6_V2()
+    download = getattr(chroma_onnx, "_download_model_if_not_exists", None)
+    if callable(download):
+        download()
+    else:
+        print("⚠️ ChromaDB ONNX download helper not found, downloading via the embedding function")
+        chroma_onnx(["warm-up"])
+    try:
+        model_dir = Path(chroma_onnx.DOWNLOAD_PATH) / chroma_onnx.EXTRACTED_FOLDER_NAME
+    except AttributeError:
+        raise ValueError("Cannot locate ChromaDB's ONNX export; set EMBEDDING_ONNX_DIR")
+    if not (model_dir / "model.onnx").exists():
+        raise ValueError(f"No model.onnx in {model_dir}; set EMBEDDING_ONNX_DIR")
+    return str(model_dir)
+
+def load_embedding_model(backend: str):
+    """Load the embedding model for a backend; every backend exposes encode(texts, batch_size=...)
+    
+    sentence-transformers (and torch) are only imported by the torch backends.
+    """
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
+    
+    if backend == "torch-int8":
+        import torch
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    
+    if backend in ("onnx", "onnx-int8"):
+        model_dir = EMBEDDING_ONNX_DIR
+        if not model_dir:
+            if EMBEDDING_MODEL_NAME != "all-MiniLM-L6-v2":
+                raise ValueError(f"Set EMBEDDING_ONNX_DIR to an ONNX export of {EMBEDDING_MODEL_NAME}")
+            model_dir = chroma_onnx_model_dir()
+        return OnnxEmbeddingBackend(model_dir, quantize=(backend == "onnx-int8"))
+    
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}'. Options: torch, torch-int8, onnx, onnx-int8")
+
+# Fixed texts for the parity check when the KB has no stored vectors to compare against
+EMBEDDING_PARITY_PROBES = [
+    "Can I claim electricity for my family day care business?",
+    "Family day care educators must keep records of all business expenses for five years.",
+    "Do I need to register for GST if my turnover is under $75,000?",
+    "An ABN is required to operate as a family day care educator.",
+    "Motor vehicle expenses can be claimed using the cents per kilometre method.",
+    "What is the 2023-24 fixed rate for working from home?",
+    "Luna answers only the question asked, in plain professional English.",
+    "The floor area percentage multiplied by business use hours gives the deductible portion.",
+]
+
+def check_embedding_parity(model, samples: int = EMBEDDING_PARITY_SAMPLES) -> Dict[str, Any]:
+    """Compare a model's vectors with the torch reference
+    
+    Re-encodes stored chunks against the vectors already in ChromaDB; on an empty KB, encodes
+    EMBEDDING_PARITY_PROBES with both the model and the torch backend instead (torch is
+    only loaded in that case).
+    """
+    stored = kb_collection.get(limit=samples, include=["documents", "embeddings"])
+    if stored['ids']:
+        texts = stored['documents']
+        existing = np.asarray(stored['embeddings'], dtype=np.float32)
+        reference = "stored"
+    else:
+        texts = EMBEDDING_PARITY_PROBES
+        existing = np.asarray(load_embedding_model("torch").encode(texts, batch_size=EMBED_BATCH_SIZE), dtype=np.float32)
+        reference = "probes"
+    
+    fresh = np.asarray(model.encode(texts, batch_size=EMBED_BATCH_SIZE), dtype=np.float32)
+    cosine = (fresh * existing).sum(axis=1) / (
+        np.linalg.norm(fresh, axis=1) * np.linalg.norm(existing, axis=1) + 1e-12
     )
+    return {
+        "checked": len(texts),
+        "reference": reference,
+        "min_cosine": round(float(cosine.min()), 5),
+        "mean_cosine": round(float(cosine.mean()), 5),
+        "passed": bool(cosine.min() >= EMBEDDING_PARITY_MIN)
+    }
 
-# Initialize embedding model
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+def init_embedding_model():
+    """Load the configured backend, falling back to torch if it fails to load or drifts from stored vectors"""
+    parity = None
+    if EMBEDDING_BACKEND != "torch":
+        try:
+            model = load_embedding_model(EMBEDDING_BACKEND)
+            parity = check_embedding_parity(model)
+            if parity["passed"]:
+                print(f"✅ Embedding backend '{EMBEDDING_BACKEND}' ready (parity: {parity})")
+                return model, EMBEDDING_BACKEND, parity
+            print(f"⚠️ Embedding backend '{EMBEDDING_BACKEND}' failed parity check {parity}, using torch")
+        except Exception as e:
+            print(f"⚠️ Embedding backend '{EMBEDDING_BACKEND}' unavailable ({e}), using torch")
+    return load_embedding_model("torch"), "torch", parity
+
+class EmbeddingCache:
+    """Two-tier embedding cache keyed by model name + text hash
+    
+    Tier 1 is an in-memory LRU; tier 2 is a SQLite table that survives restarts. Disk writes
+    are queued and flushed in batches by a background writer, so request threads never wait
+    on an INSERT/commit, and the table is capped at max_disk_items rows.
+    """
+    
+    def __init__(self, model_name: str, max_items: int, path: Optional[str] = None, max_disk_items: int = 0):
+        self.model_name = model_name
+        self.max_items = max_items
+        self.max_disk_items = max_disk_items
+        self.path = path
+        self.memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = None
+        self.writer_db = None
+        self.pending: Dict[str, bytes] = {}
+        self.pending_ready = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.disk_rows = 0
+        self.disk_evictions = 0
+        if path:
+            try:
+                self.db = sqlite3.connect(path, check_same_thread=False)
+                # WAL lets lookups read while the writer commits
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+                self.db.commit()
+                self.disk_rows = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                self.writer_db = sqlite3.connect(path, check_same_thread=False)
+            except Exception as e:
+                print(f"⚠️ Embedding cache disk tier disabled ({e})")
+                self.db = None
+                self.writer_db = None
+        if self.writer_db is not None:
+            threading.Thread(target=self.write_behind, name="embedding-cache-writer", daemon=True).start()
+            atexit.register(self.flush)
+    
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode('utf-8')).hexdigest()
+    
+    def remember(self, key: str, vector: np.ndarray):
+        """Insert into the LRU tier (caller holds lock)"""
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+    
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up vectors for texts; None marks a miss"""
+        keys = [self.key(text) for text in texts]
+        found: List[Optional[np.ndarray]] = [None] * len(texts)
+        with self.lock:
+            disk_lookup = []
+            for i, key in enumerate(keys):
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                    self.memory_hits += 1
+                    found[i] = vector
+                else:
+                    disk_lookup.append(i)
+            
+            if disk_lookup and self.db is not None:
+                wanted = {keys[i] for i in disk_lookup}
+                rows = {}
+                wanted_list = list(wanted)
+                for start in range(0, len(wanted_list), 500):
+                    batch = wanted_list[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    for key, blob in self.db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                    ):
+                        rows[key] = np.frombuffer(blob, dtype=np.float32)
+                for i in disk_lookup:
+                    vector = rows.get(keys[i])
+                    if vector is not None:
+                        self.disk_hits += 1
+                        self.remember(keys[i], vector)
+                        found[i] = vector
+            
+            self.misses += sum(1 for vector in found if vector is None)
+        return found
+    
+    def put_many(self, texts: List[str], vectors: List[np.ndarray]):
+        """Store freshly computed vectors in memory and queue them for the disk tier"""
+        rows = {}
+        with self.lock:
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                vector = np.asarray(vector, dtype=np.float32)
+                self.remember(key, vector)
+                rows[key] = vector.tobytes()
+        if self.writer_db is not None and rows:
+            with self.pending_ready:
+                self.pending.update(rows)
+                self.pending_ready.notify()
+    
+    def write_behind(self):
+        """Background writer: flush queued vectors whenever some are pending"""
+        while True:
+            with self.pending_ready:
+                while not self.pending:
+                    self.pending_ready.wait()
+            self.flush()
+    
+    def flush(self):
+        """Write queued vectors in one transaction, then evict the oldest rows over the cap"""
+        with self.write_lock:
+            with self.pending_ready:
+                rows = list(self.pending.items())
+                self.pending.clear()
+            if not rows or self.writer_db is None:
+                return
+            try:
+                self.writer_db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                self.disk_rows += len(rows)
+                if self.max_disk_items and self.disk_rows > self.max_disk_items:
+                    # Evict down to 90% of the cap so trimming is not repeated on every flush
+                    self.disk_rows = self.writer_db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                    excess = self.disk_rows - int(self.max_disk_items * 0.9)
+                    if excess > 0:
+                        self.writer_db.execute(
+                            "DELETE FROM embeddings WHERE rowid IN "
+                            "(SELECT rowid FROM embeddings ORDER BY rowid LIMIT ?)",
+                            (excess,)
+                        )
+                        self.disk_rows -= excess
+                        self.disk_evictions += excess
+                self.writer_db.commit()
+            except Exception as e:
+                print(f"⚠️ Embedding cache write failed: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            disk_entries = None
+            if self.db is not None:
+                disk_entries = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "model": self.model_name,
+                "memory_entries": len(self.memory),
+                "memory_capacity": self.max_items,
+                "disk_entries": disk_entries,
+                "disk_capacity": self.max_disk_items or None,
+                "disk_pending": len(self.pending),
+                "disk_evictions": self.disk_evictions,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None
+            }
+
+class TTLCache:
+    """Thread-safe LRU cache with optional per-entry time-to-live and hit/miss counters"""
+    
+    def __init__(self, max_items: int, ttl_seconds: float = 0):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+    
+    def get(self, key: Any) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self.entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key: Any, value: Any):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "capacity": self.max_items,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None
+            }
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a query for cache lookups: case, whitespace and trailing punctuation ignored"""
+    return " ".join(query.lower().split()).rstrip("?!.,; ")
+
+query_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+def embed_query(query: str) -> List[float]:
+    """Embed a search query, serving repeated (normalized) questions from the query cache"""
+    return embed_queries([query])[0]
+
+def embed_queries(queries: List[str]) -> List[List[float]]:
+    """Embed many search queries; query cache misses are encoded together in one batch"""
+    keys = [normalize_query(query) for query in queries]
+    vectors = [query_cache.get(key) for key in keys]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        encoded = embed_texts([queries[i] for i in missing])
+        for i, vector in zip(missing, encoded):
+            vectors[i] = vector
+            query_cache.put(keys[i], vector)
+    return vectors
+
+def embed_texts(texts: List[str], batch_size: int = EMBED_BATCH_SIZE) -> List[List[float]]:
+    """Encode many texts in batched forward passes, serving repeats from the embedding cache"""
+    if not texts:
+        return []
+    vectors = embedding_cache.get_many(texts)
+    
+    # Encode each distinct missing text once
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    if missing:
+        encoded = embedding_model.encode(missing, batch_size=batch_size, show_progress_bar=False)
+        embedding_cache.put_many(missing, list(encoded))
+        fresh = dict(zip(missing, encoded))
+        vectors = [vector if vector is not None else fresh[text] for text, vector in zip(texts, vectors)]
+    
+    return [np.asarray(vector, dtype=np.float32).tolist() for vector in vectors]
 
-# Load core documents if KB is empty
-initialize_knowledge_base()
+def init_embedder():
+    """Load the embedding model and open the embedding cache"""
+    global embedding_model, embedding_backend, embedding_parity, embedding_cache
+    embedding_model, embedding_backend, embedding_parity = init_embedding_model()
+    
+    # Cache entries are only shared between runs of the same backend
+    embedding_cache = EmbeddingCache(
+        EMBEDDING_MODEL_NAME if embedding_backend == "torch" else f"{EMBEDDING_MODEL_NAME}@{embedding_backend}",
+        EMBEDDING_CACHE_SIZE,
+        EMBEDDING_CACHE_PATH or None,
+        EMBEDDING_CACHE_DISK_MAX
+    )
 
 # Ollama configuration
 OLLAMA_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434")
@@ -281,6 +822,905 @@ OLLAMA_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434")
 # OpenAI API key for Luna KB queries
 # Uses OPENAI_API_KEY_LUNA (falls back to OPENAI_API_KEY for backwards compatibility)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY_LUNA") or os.getenv("OPENAI_API_KEY")
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com")
+
+# Next.js app API (user context + conversation history)
+APP_API_URL = os.getenv("APP_API_URL", "http://localhost:3000")
+
+# Outbound HTTP
+# One pooled async client per upstream (Ollama, OpenAI, Next.js app) with keep-alive, so
+# LLM calls never block the event loop and skip the TCP/TLS handshake on reuse.
+# HTTP_CONNECT_TIMEOUT: seconds to establish a connection (any upstream)
+# *_READ_TIMEOUT: seconds to wait for response data from each upstream
+# HTTP_MAX_CONNECTIONS / HTTP_MAX_KEEPALIVE: pool size per upstream
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "180"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "30"))
+APP_API_READ_TIMEOUT = float(os.getenv("APP_API_READ_TIMEOUT", "5"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+
+# LLM routing
+# LLM_HEDGING: if the primary provider has not answered (or, when streaming, sent its first
+#   token) within the hedge delay, start the alternate in parallel; first success wins and
+#   the loser is cancelled
+# HEDGE_PERCENTILE: hedge delay = this percentile of the primary's recent latency
+# HEDGE_MIN_DELAY_MS / HEDGE_MAX_DELAY_MS: clamp for the percentile-based delay
+# HEDGE_DEFAULT_DELAY_MS: delay used until HEDGE_MIN_SAMPLES latencies have been seen
+# LLM_STATS_WINDOW: recent latencies kept per provider (see /llm/stats)
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "1000"))
+HEDGE_MAX_DELAY_MS = float(os.getenv("HEDGE_MAX_DELAY_MS", "30000"))
+HEDGE_DEFAULT_DELAY_MS = float(os.getenv("HEDGE_DEFAULT_DELAY_MS", "8000"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+LLM_STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "200"))
+
+# Circuit breakers (per LLM provider)
+# An open provider is skipped and requests go straight to the other one; once
+# BREAKER_OPEN_SECONDS have passed a background probe (half-open) decides whether it closes.
+# BREAKER_FAILURE_THRESHOLD: consecutive failures that open the breaker
+# BREAKER_ERROR_RATE: also open when this share of the last BREAKER_WINDOW calls failed
+# BREAKER_SLOW_CALL_MS: a completion slower than this counts as a failure (0 = off)
+# BREAKER_PROBE_INTERVAL: seconds between background checks for providers due a probe
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "true").lower() == "true"
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_SLOW_CALL_MS = float(os.getenv("BREAKER_SLOW_CALL_MS", "60000"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_PROBE_INTERVAL = float(os.getenv("BREAKER_PROBE_INTERVAL", "5"))
+
+# Prompt token budget
+# The rulebook, instructions and latest message are always sent; top-ranked KB chunks and
+# then earlier turns (newest first) fill the rest of each provider's budget.
+# OLLAMA_NUM_CTX: context window requested from Ollama (llama3:8b supports 8192)
+# OPENAI_PROMPT_BUDGET: prompt tokens sent to OpenAI (a cost/latency cap; gpt-4o allows 128k)
+# PROMPT_REPLY_RESERVE: tokens of Ollama's window left for the reply
+# HISTORY_SUMMARY_TOKENS: room for a note listing the questions of trimmed turns (0 = drop silently)
+# Counts use tiktoken when installed, otherwise ~4 characters per token
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+OPENAI_PROMPT_BUDGET = int(os.getenv("OPENAI_PROMPT_BUDGET", "16000"))
+PROMPT_REPLY_RESERVE = int(os.getenv("PROMPT_REPLY_RESERVE", "600"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "200"))
+
+http_clients: Dict[str, httpx.AsyncClient] = {}
+http_client_loops: Dict[str, asyncio.AbstractEventLoop] = {}
+
+def get_http_client(upstream: str) -> httpx.AsyncClient:
+    """Shared pooled client for an upstream ("ollama", "openai" or "app")
+    
+    Pools are bound to the event loop that created them, so a new loop gets fresh clients.
+    """
+    loop = asyncio.get_running_loop()
+    client = http_clients.get(upstream)
+    if client is None or client.is_closed or http_client_loops.get(upstream) is not loop:
+        base_url, read_timeout = {
+            "ollama": (OLLAMA_URL, OLLAMA_READ_TIMEOUT),
+            "openai": (OPENAI_API_BASE, OPENAI_READ_TIMEOUT),
+            "app": (APP_API_URL, APP_API_READ_TIMEOUT),
+        }[upstream]
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+        )
+        http_clients[upstream] = client
+        http_client_loops[upstream] = loop
+    return client
+
+# Chunking
+# CHUNKER: "structured" (paragraph/sentence packing) or "fixed" (legacy 500-char slices)
+# CHUNK_MAX_TOKENS: token budget per structured chunk (all-MiniLM-L6-v2 truncates at 256 wordpieces)
+# CHUNK_MIN_TOKENS: a trailing chunk smaller than this is merged into the previous one
+CHUNKER = os.getenv("CHUNKER", "structured")
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "40"))
+
+# Bulk ingestion batch size
+# CHROMA_WRITE_BATCH_SIZE: chunks per kb_collection.add call
+CHROMA_WRITE_BATCH_SIZE = int(os.getenv("CHROMA_WRITE_BATCH_SIZE", "500"))
+
+# Background ingestion jobs
+# INGEST_WORKERS: worker threads running extraction + embedding off the event loop
+# INGEST_MAX_PENDING: queued/running jobs allowed before uploads are rejected (429)
+# INGEST_JOB_HISTORY: finished jobs kept for /ingest/jobs
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "20"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "200"))
+
+# Parallel PDF extraction
+# PDF_PARALLEL_MIN_PAGES: PDFs with fewer pages are extracted serially (pool overhead not worth it)
+# PDF_EXTRACT_WORKERS: processes used for page-range extraction
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 2)))
+
+# Retrieval
+# SEARCH_MODE: default retrieval for /kb/search and /chat - "vector" (dense only) or
+#   "hybrid" (BM25 over chunk text fused with vector results by reciprocal rank fusion)
+# HYBRID_RRF_K: RRF constant - higher flattens the contribution of top ranks
+# BM25_K1 / BM25_B: BM25 term-frequency saturation and length normalisation
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector")
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# SEARCH_ENGINE: dense retrieval engine - "chroma" (HNSW) or "exact" (brute-force matmul over an
+#   in-process memory-mapped float32 matrix; faster for KBs of a few thousand chunks)
+# EXACT_INDEX_DIR: directory for the exact engine's backing file (default: system temp dir). Each
+#   process maps its own private file, rebuilt from ChromaDB at start-up and removed at exit
+SEARCH_ENGINE = os.getenv("SEARCH_ENGINE", "chroma")
+EXACT_INDEX_DIR = os.getenv("EXACT_INDEX_DIR", "") or None
+# SEARCH_DIVERSIFY: pick results by maximal marginal relevance, drop near-duplicates and
+#   merge neighbouring chunks of a document into one passage
+# MMR_LAMBDA: 1.0 = pure relevance, lower values favour diversity
+# DEDUP_MIN_SIMILARITY: candidates this similar to an already selected chunk are dropped
+# DIVERSIFY_CANDIDATES: minimum candidates fetched per query when diversifying (at least 4x limit)
+# DIVERSIFY_MAX_PASSAGE_CHUNKS: most chunks merged into one passage, so a diversified result
+#   holds at most limit x this many chunks
+SEARCH_DIVERSIFY = os.getenv("SEARCH_DIVERSIFY", "false").lower() == "true"
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+DEDUP_MIN_SIMILARITY = float(os.getenv("DEDUP_MIN_SIMILARITY", "0.95"))
+DIVERSIFY_CANDIDATES = int(os.getenv("DIVERSIFY_CANDIDATES", "40"))
+DIVERSIFY_MAX_PASSAGE_CHUNKS = max(1, int(os.getenv("DIVERSIFY_MAX_PASSAGE_CHUNKS", "3")))
+# CHAT_MODE_FILTERS: JSON of default KB metadata filters per /chat mode, e.g.
+#   {"educator": {"audience": {"$ne": "internal"}}}  (note: $ne also excludes chunks without the key)
+CHAT_MODE_FILTERS: Dict[str, Dict[str, Any]] = json.loads(os.getenv("CHAT_MODE_FILTERS", "{}"))
+# Reranking
+# RERANK_ENABLED: rescore first-stage candidates with a local cross-encoder (per request: "rerank")
+# RERANK_MODEL: cross-encoder (sentence-transformers CrossEncoder)
+# RERANK_CANDIDATES: top-N first-stage candidates rescored per query
+# RERANK_BUDGET_MS: deadline for the cross-encoder; on overrun the first-stage order is returned
+# CHAT_KB_LIMIT: KB chunks sent to the LLM per /chat turn (with reranking, 2-3 is usually enough)
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+CHAT_KB_LIMIT = int(os.getenv("CHAT_KB_LIMIT", "5"))
+# KB_SEARCH_BATCH_MAX: queries accepted by one /kb/search/batch call
+KB_SEARCH_BATCH_MAX = int(os.getenv("KB_SEARCH_BATCH_MAX", "256"))
+
+# Result scoring
+# Retrieved chunks are ranked by relevance x category weight x document weight.
+# SCORE_CATEGORY_WEIGHTS: per-category multipliers, e.g. "Core=2.0,GST=1.2"
+# SCORE_DOCUMENT_WEIGHTS: per-document multipliers keyed by source_key or doc_id
+# A document ingested with metadata {"score_weight": 1.5} uses that instead.
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Parse "key=weight,key=weight" into a dict"""
+    weights = {}
+    for item in spec.split(","):
+        if "=" in item:
+            key, value = item.rsplit("=", 1)
+            weights[key.strip()] = float(value)
+    return weights
+
+SCORE_CATEGORY_WEIGHTS = parse_weights(os.getenv("SCORE_CATEGORY_WEIGHTS", "Core=2.0"))
+SCORE_DOCUMENT_WEIGHTS = parse_weights(os.getenv("SCORE_DOCUMENT_WEIGHTS", ""))
+
+rerank_model = None
+rerank_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+rerank_idle = threading.BoundedSemaphore(1)
+
+pdf_executor: Optional[ProcessPoolExecutor] = None
+pdf_executor_lock = threading.Lock()
+
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+ingest_jobs: Dict[str, Dict[str, Any]] = {}
+ingest_jobs_lock = threading.Lock()
+
+LEXICAL_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[/.][a-z0-9]+)*")
+LEXICAL_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it its me my of on or "
+    "our so that the their there this to was we what when where which who why will with you your".split()
+)
+
+def lexical_tokens(text: str) -> List[str]:
+    """Lowercase word tokens for BM25; keeps ruling IDs like "2023/1" and "s8.1" intact"""
+    return [t for t in LEXICAL_TOKEN_PATTERN.findall(text.lower()) if t not in LEXICAL_STOPWORDS]
+
+class LexicalIndex:
+    """In-memory BM25 inverted index over chunk text, keyed by Chroma chunk id
+    
+    Built from ChromaDB at start-up, then kept in step by write_chunks and every delete.
+    """
+    
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_terms: Dict[str, Counter] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+        self.lock = threading.Lock()
+    
+    def add(self, ids: List[str], texts: List[str]):
+        with self.lock:
+            for chunk_id, text in zip(ids, texts):
+                self._remove(chunk_id)
+                terms = Counter(lexical_tokens(text or ""))
+                self.doc_terms[chunk_id] = terms
+                self.doc_lengths[chunk_id] = sum(terms.values())
+                self.total_length += self.doc_lengths[chunk_id]
+                for term, tf in terms.items():
+                    self.postings.setdefault(term, {})[chunk_id] = tf
+    
+    def remove(self, ids: Iterable[str]):
+        with self.lock:
+            for chunk_id in ids:
+                self._remove(chunk_id)
+    
+    def _remove(self, chunk_id: str):
+        terms = self.doc_terms.pop(chunk_id, None)
+        if terms is None:
+            return
+        self.total_length -= self.doc_lengths.pop(chunk_id)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(chunk_id, None)
+                if not posting:
+                    del self.postings[term]
+    
+    def clear(self):
+        with self.lock:
+            self.postings.clear()
+            self.doc_terms.clear()
+            self.doc_lengths.clear()
+            self.total_length = 0
+    
+    def rebuild(self, collection, page_size: int = 5000):
+        """Re-index every chunk in a Chroma collection"""
+        self.clear()
+        offset = 0
+        while True:
+            page = collection.get(include=["documents"], limit=page_size, offset=offset)
+            if not page['ids']:
+                break
+            self.add(page['ids'], page['documents'])
+            offset += len(page['ids'])
+    
+    def search(self, query: str, limit: int) -> List[Tuple[str, float]]:
+        """Top chunk ids by BM25 score"""
+        terms = set(lexical_tokens(query))
+        with self.lock:
+            n_docs = len(self.doc_terms)
+            if not terms or not n_docs:
+                return []
+            avg_length = self.total_length / n_docs or 1.0
+            scores: Dict[str, float] = {}
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = np.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for chunk_id, tf in posting.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [(chunk_id, float(score)) for chunk_id, score in ranked[:limit]]
+    
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"chunks": len(self.doc_terms), "terms": len(self.postings)}
+
+lexical_index = LexicalIndex(k1=BM25_K1, b=BM25_B)
+
+WHERE_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "$eq": lambda value, target: value == target,
+    "$ne": lambda value, target: value != target,
+    "$gt": lambda value, target: value > target,
+    "$gte": lambda value, target: value >= target,
+    "$lt": lambda value, target: value < target,
+    "$lte": lambda value, target: value <= target,
+    "$in": lambda value, target: value in target,
+    "$nin": lambda value, target: value not in target,
+}
+
+def matches_where(metadata: Dict[str, Any], where: Dict[str, Any]) -> bool:
+    """Evaluate a ChromaDB `where` clause against one chunk's metadata (missing keys never match)"""
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        else:
+            if key not in metadata:
+                return False
+            operator, target = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+            try:
+                if not WHERE_OPERATORS[operator](metadata[key], target):
+                    return False
+            except TypeError:
+                return False
+    return True
+
+class ExactSearchIndex:
+    """Brute-force cosine search over a memory-mapped float32 embedding matrix
+    
+    Rows 0..count-1 hold L2-normalised chunk embeddings; ids, documents and metadata are kept
+    in parallel lists. query() mirrors kb_collection.query so vector_search can use either engine.
+    Rebuilt from ChromaDB at start-up, then kept in step by write_chunks, metadata updates and deletes.
+    The backing file is private to this process (another process truncating a file we have
+    mapped would crash us with SIGBUS) and is deleted by close(), when the index is
+    garbage-collected, or at exit.
+    """
+    
+    def __init__(self, directory: Optional[str] = None, capacity: int = 1024):
+        if directory:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix=f"exact_index-{os.getpid()}-", suffix=".f32", dir=directory)
+        os.close(fd)
+        self.finalizer = weakref.finalize(self, Path(self.path).unlink, missing_ok=True)
+        self.initial_capacity = capacity
+        self.vectors: Optional[np.memmap] = None
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.rows: Dict[str, int] = {}
+        self.lock = threading.Lock()
+    
+    def _allocate(self, capacity: int, dim: int):
+        """Create the backing file, or grow it while keeping the existing rows"""
+        if self.vectors is None or self.vectors.shape[1] != dim:
+            self.vectors = np.memmap(self.path, dtype=np.float32, mode="w+", shape=(capacity, dim))
+            return
+        self.vectors.flush()
+        self.vectors = None
+        with open(self.path, "r+b") as f:
+            f.truncate(capacity * dim * 4)
+        self.vectors = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(capacity, dim))
+    
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict[str, Any]]):
+        if not ids:
+            return
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        with self.lock:
+            needed = len(self.ids) + len(ids)
+            if self.vectors is None or self.vectors.shape[1] != matrix.shape[1]:
+                self._allocate(max(self.initial_capacity, needed), matrix.shape[1])
+            elif needed > self.vectors.shape[0]:
+                self._allocate(max(needed, self.vectors.shape[0] * 2), matrix.shape[1])
+            for chunk_id, vector, document, metadata in zip(ids, matrix, documents, metadatas):
+                row = self.rows.get(chunk_id)
+                if row is None:
+                    row = len(self.ids)
+                    self.rows[chunk_id] = row
+                    self.ids.append(chunk_id)
+                    self.documents.append(document)
+                    self.metadatas.append(metadata)
+                else:
+                    self.documents[row] = document
+                    self.metadatas[row] = metadata
+                self.vectors[row] = vector
+    
+    def update_metadata(self, ids: List[str], metadatas: List[Dict[str, Any]]):
+        with self.lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                row = self.rows.get(chunk_id)
+                if row is not None:
+                    self.metadatas[row] = metadata
+    
+    def remove(self, ids: Iterable[str]):
+        """Delete rows by moving the last row into each gap (keeps the matrix contiguous)"""
+        with self.lock:
+            for chunk_id in ids:
+                row = self.rows.pop(chunk_id, None)
+                if row is None:
+                    continue
+                last = len(self.ids) - 1
+                if row != last:
+                    self.vectors[row] = self.vectors[last]
+                    self.ids[row] = self.ids[last]
+                    self.documents[row] = self.documents[last]
+                    self.metadatas[row] = self.metadatas[last]
+                    self.rows[self.ids[row]] = row
+                self.ids.pop()
+                self.documents.pop()
+                self.metadatas.pop()
+    
+    def clear(self):
+        with self.lock:
+            self.ids, self.documents, self.metadatas, self.rows = [], [], [], {}
+    
+    def close(self):
+        """Delete the backing file
+        
+        The mapping stays readable until the index is garbage-collected, so a query that
+        still holds a replaced index finishes normally.
+        """
+        self.finalizer()
+    
+    def rebuild(self, collection, page_size: int = 5000):
+        """Reload every chunk (embedding, text, metadata) from a Chroma collection"""
+        self.clear()
+        offset = 0
+        while True:
+            page = collection.get(
+                include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset
+            )
+            if not page['ids']:
+                break
+            self.add(page['ids'], page['embeddings'], page['documents'], page['metadatas'])
+            offset += len(page['ids'])
+        if self.vectors is not None:
+            self.vectors.flush()
+    
+    def query(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int,
+        include: Iterable[str] = ("documents", "metadatas", "distances"),
+        where: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Top n_results by cosine distance per query, shaped like a ChromaDB query result"""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        results: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": []}
+        with self.lock:
+            count = len(self.ids)
+            candidates = np.arange(count)
+            if where and count:
+                candidates = np.flatnonzero([matches_where(metadata, where) for metadata in self.metadatas])
+            k = min(n_results, len(candidates))
+            
+            if k:
+                matrix = self.vectors[:count] if len(candidates) == count else self.vectors[candidates]
+                similarities = queries @ matrix.T
+            for q in range(len(queries)):
+                if not k:
+                    top, top_similarities = np.array([], dtype=int), np.array([], dtype=np.float32)
+                else:
+                    top = np.argpartition(-similarities[q], k - 1)[:k]
+                    top = top[np.argsort(-similarities[q][top])]
+                    top_similarities = similarities[q][top]
+                    top = candidates[top]
+                results["ids"].append([self.ids[row] for row in top])
+                results["documents"].append([self.documents[row] for row in top])
+                results["metadatas"].append([self.metadatas[row] for row in top])
+                results["distances"].append([float(1 - similarity) for similarity in top_similarities])
+                if "embeddings" in include:
+                    results["embeddings"].append([self.vectors[row].tolist() for row in top])
+        return results
+    
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "chunks": len(self.ids),
+                "capacity": self.vectors.shape[0] if self.vectors is not None else 0,
+                "path": self.path
+            }
+
+exact_index: Optional[ExactSearchIndex] = None
+
+# Index writes go through record_index_write, which applies them to the live indexes and,
+# while build_search_indexes is copying ChromaDB, journals them so they can be replayed onto
+# the new indexes before they are swapped in (otherwise they would be lost with the old ones)
+index_write_lock = threading.Lock()
+index_write_journal: Optional[List[Tuple[str, tuple]]] = None
+
+def apply_index_write(lexical: LexicalIndex, exact: Optional[ExactSearchIndex], op: str, args: tuple):
+    if op == "add":
+        ids, embeddings, documents, metadatas = args
+        lexical.add(ids, documents)
+        if exact is not None:
+            exact.add(ids, embeddings, documents, metadatas)
+    elif op == "update":
+        if exact is not None:
+            exact.update_metadata(*args)
+    elif op == "remove":
+        lexical.remove(args[0])
+        if exact is not None:
+            exact.remove(args[0])
+    elif op == "clear":
+        lexical.clear()
+        if exact is not None:
+            exact.clear()
+
+def record_index_write(op: str, *args):
+    with index_write_lock:
+        apply_index_write(lexical_index, exact_index, op, args)
+        if index_write_journal is not None:
+            index_write_journal.append((op, args))
+
+def index_chunks(ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict[str, Any]]):
+    """Mirror newly written chunks into the in-process search indexes"""
+    record_index_write("add", ids, embeddings, documents, metadatas)
+
+def reindex_chunk_metadata(ids: List[str], metadatas: List[Dict[str, Any]]):
+    """Mirror replaced chunk metadata into the in-process search indexes"""
+    record_index_write("update", ids, metadatas)
+
+def unindex_chunks(ids: List[str]):
+    """Drop deleted chunks from the in-process search indexes"""
+    record_index_write("remove", ids)
+
+def clear_search_indexes():
+    """Empty the in-process search indexes (the KB was cleared)"""
+    record_index_write("clear")
+
+index_rebuild_lock = threading.Lock()
+
+def build_search_indexes(page_size: int = 5000):
+    """(Re)build the in-process search indexes from ChromaDB in one pass, swapping them in once complete
+    
+    Searches keep using the old indexes until the swap; writes made during the copy are
+    replayed onto the new indexes first.
+    """
+    global lexical_index, exact_index, index_write_journal
+    with index_rebuild_lock:
+        started = time.perf_counter()
+        # Start journaling before reading ChromaDB: a write is either already in ChromaDB
+        # when the copy reads it or journaled (replaying one that was both is harmless)
+        with index_write_lock:
+            index_write_journal = []
+        try:
+            lexical = LexicalIndex(k1=BM25_K1, b=BM25_B)
+            exact = ExactSearchIndex(EXACT_INDEX_DIR) if SEARCH_ENGINE == "exact" else None
+            include = ["documents", "embeddings", "metadatas"] if exact is not None else ["documents"]
+            offset = 0
+            while True:
+                page = kb_collection.get(include=include, limit=page_size, offset=offset)
+                if not page['ids']:
+                    break
+                lexical.add(page['ids'], page['documents'])
+                if exact is not None:
+                    exact.add(page['ids'], page['embeddings'], page['documents'], page['metadatas'])
+                offset += len(page['ids'])
+            if exact is not None and exact.vectors is not None:
+                exact.vectors.flush()
+            with index_write_lock:
+                for op, args in index_write_journal:
+                    apply_index_write(lexical, exact, op, args)
+                previous = exact_index
+                lexical_index, exact_index = lexical, exact
+        finally:
+            with index_write_lock:
+                index_write_journal = None
+    if previous is not None:
+        previous.close()
+    elapsed = time.perf_counter() - started
+    print(f"🔤 Lexical index built: {lexical.stats()['chunks']} chunks in {elapsed:.2f}s")
+    if exact is not None:
+        print(f"🧮 Exact search index built: {exact.stats()['chunks']} chunks in {elapsed:.2f}s")
+
+# Rebuilds after another process changed the KB run here, off the request path. At most one
+# more is queued behind a running one: it starts after, so it sees every change.
+index_rebuild_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-rebuild")
+index_rebuild_guard = threading.Lock()
+index_rebuild_queued = False
+
+def run_queued_index_rebuild():
+    global index_rebuild_queued
+    with index_rebuild_guard:
+        index_rebuild_queued = False
+    try:
+        build_search_indexes()
+    except Exception as e:
+        print(f"⚠️ Search index rebuild failed: {e}")
+
+def schedule_index_rebuild():
+    """Rebuild the search indexes in the background"""
+    global index_rebuild_queued
+    with index_rebuild_guard:
+        if index_rebuild_queued:
+            return
+        index_rebuild_queued = True
+    index_rebuild_executor.submit(run_queued_index_rebuild)
+
+# Startup
+# Heavy work (ChromaDB, embedding model, core KB bootstrap, Ollama warm-up) runs in a
+# background thread so uvicorn binds immediately. /ready reports each stage; other
+# endpoints answer 503 until the required stages are ready.
+# STARTUP_PREWARM_OLLAMA: warm llama3:8b as the last (non-blocking) stage
+# STARTUP_RETRIES: extra attempts for a failed required stage, with exponential backoff from
+#   STARTUP_RETRY_DELAY seconds (capped at STARTUP_RETRY_MAX_DELAY)
+# STARTUP_EXIT_ON_FAILURE: exit the server (status 1) when a required stage still fails, so the
+#   platform restarts it instead of serving 503 forever
+STARTUP_PREWARM_OLLAMA = os.getenv("STARTUP_PREWARM_OLLAMA", "true").lower() == "true"
+STARTUP_RETRIES = int(os.getenv("STARTUP_RETRIES", "5"))
+STARTUP_RETRY_DELAY = float(os.getenv("STARTUP_RETRY_DELAY", "2"))
+STARTUP_RETRY_MAX_DELAY = float(os.getenv("STARTUP_RETRY_MAX_DELAY", "60"))
+STARTUP_EXIT_ON_FAILURE = os.getenv("STARTUP_EXIT_ON_FAILURE", "true").lower() == "true"
+STARTUP_REQUIRED_STAGES = ("vector_store", "embedder", "knowledge_base")
+STARTUP_OPEN_PATHS = {"/", "/health", "/ready", "/docs", "/redoc", "/openapi.json"}
+
+startup_state: Dict[str, Dict[str, Any]] = {
+    stage: {"status": "pending", "seconds": None, "error": None, "attempts": 0}
+    for stage in STARTUP_REQUIRED_STAGES + ("reranker", "llm")
+}
+startup_lock = threading.Lock()
+services_ready = threading.Event()
+
+def run_startup_stage(stage: str, fn: Callable[[], Any]) -> bool:
+    """Run one startup stage, recording its status and duration"""
+    startup_state[stage]["status"] = "loading"
+    startup_state[stage]["attempts"] += 1
+    started = time.perf_counter()
+    try:
+        result = fn()
+        startup_state[stage]["status"] = "unavailable" if result is False else "ready"
+        return True
+    except Exception as e:
+        print(f"❌ Startup stage '{stage}' failed: {e}")
+        startup_state[stage]["status"] = "error"
+        startup_state[stage]["error"] = str(e)
+        return False
+    finally:
+        startup_state[stage]["seconds"] = round(time.perf_counter() - started, 2)
+
+def run_required_stage(stage: str, fn: Callable[[], Any]) -> bool:
+    """Run a required stage, retrying failures with exponential backoff"""
+    delay = STARTUP_RETRY_DELAY
+    for attempt in range(STARTUP_RETRIES + 1):
+        if attempt:
+            print(f"🔁 Retrying startup stage '{stage}' in {delay:.1f}s (retry {attempt}/{STARTUP_RETRIES})")
+            startup_state[stage]["status"] = "retrying"
+            time.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_DELAY)
+        if run_startup_stage(stage, fn):
+            return True
+    return False
+
+def initialize_services(prewarm_llm: bool = False, exit_on_failure: bool = False):
+    """Run the staged start-up (blocking); safe to call more than once
+    
+    exit_on_failure: terminate the process if a required stage fails after all retries.
+    """
+    with startup_lock:
+        if services_ready.is_set():
+            return
+        stages = [
+            ("vector_store", init_vector_store),
+            ("embedder", init_embedder),
+            ("knowledge_base", initialize_knowledge_base),
+        ]
+        for stage, fn in stages:
+            if startup_state[stage]["status"] == "ready":
+                continue
+            if not run_required_stage(stage, fn):
+                startup_state["reranker"]["status"] = "skipped"
+                startup_state["llm"]["status"] = "skipped"
+                if exit_on_failure:
+                    print(f"💀 Startup stage '{stage}' failed after {STARTUP_RETRIES} retries, exiting for a restart")
+                    sys.stdout.flush()
+                    os._exit(1)
+                return
+        services_ready.set()
+        print("✅ Luna RAG services ready")
+    
+    # Load prompt tokenizers now rather than on the first chat (tiktoken fetches encodings once)
+    for provider in TOKEN_ENCODINGS:
+        token_encoder(provider)
+    
+    if RERANK_ENABLED:
+        run_startup_stage("reranker", init_reranker)
+    else:
+        startup_state["reranker"]["status"] = "skipped"
+    
+    if prewarm_llm:
+        run_startup_stage("llm", prewarm_ollama)
+    else:
+        startup_state["llm"]["status"] = "skipped"
+
+@app.on_event("startup")
+async def start_background_initialization():
+    """Kick off staged initialization without blocking the server from accepting connections"""
+    threading.Thread(
+        target=initialize_services,
+        kwargs={"prewarm_llm": STARTUP_PREWARM_OLLAMA, "exit_on_failure": STARTUP_EXIT_ON_FAILURE},
+        name="startup",
+        daemon=True
+    ).start()
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Close pooled outbound HTTP connections"""
+    for client in list(http_clients.values()):
+        await client.aclose()
+    http_clients.clear()
+
+@app.middleware("http")
+async def require_ready(request: Request, call_next):
+    """Reject traffic with 503 until the vector store, embedder and core KB are ready"""
+    if not services_ready.is_set() and request.url.path not in STARTUP_OPEN_PATHS:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Luna is starting up. Please try again shortly.", "components": startup_state},
+            headers={"Retry-After": "5"}
+        )
+    return await call_next(request)
+
+# Semantic answer cache for /chat
+# ANSWER_CACHE_ENABLED: serve stored answers for near-identical standalone questions (opt-in:
+#   questions differing only in a year, threshold or "GST"/"no GST" embed very close together)
+# ANSWER_CACHE_MAX_DISTANCE: max cosine distance between query embeddings for a hit
+# ANSWER_CACHE_SIZE / ANSWER_CACHE_TTL: stored answers and their lifetime in seconds (0 = never expire)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_MAX_DISTANCE = float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.02"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "500"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+
+class SemanticAnswerCache:
+    """Stores /chat answers keyed by query embedding, mode, prompt context and KB version
+    
+    A lookup scans entries with the same mode/context/KB version and returns the closest one
+    within the distance threshold. Any KB change bumps the version and clears the cache.
+    """
+    
+    def __init__(self, max_items: int, max_distance: float, ttl_seconds: float = 0):
+        self.max_items = max_items
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.kb_version = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    def lookup(self, vector: List[float], mode: str, context_key: str) -> Optional[Dict[str, Any]]:
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) + 1e-12)
+        now = time.monotonic()
+        with self.lock:
+            candidates = [
+                (key, entry) for key, entry in self.entries.items()
+                if entry["mode"] == mode
+                and entry["context_key"] == context_key
+                and entry["kb_version"] == self.kb_version
+                and not (self.ttl_seconds and now - entry["created"] > self.ttl_seconds)
+            ]
+            if candidates:
+                similarities = np.stack([entry["vector"] for _, entry in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if 1 - float(similarities[best]) <= self.max_distance:
+                    key, entry = candidates[best]
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return {**entry["response"], "similarity": round(float(similarities[best]), 4)}
+            self.misses += 1
+            return None
+    
+    def store(self, vector: List[float], mode: str, context_key: str, kb_version: int, response: Dict[str, Any]):
+        stored = np.asarray(vector, dtype=np.float32)
+        with self.lock:
+            # Skip answers generated against a KB that changed while the LLM was running
+            if kb_version != self.kb_version:
+                return
+            self.entries[str(uuid.uuid4())] = {
+                "vector": stored / (np.linalg.norm(stored) + 1e-12),
+                "mode": mode,
+                "context_key": context_key,
+                "kb_version": kb_version,
+                "created": time.monotonic(),
+                "response": response
+            }
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+    
+    def invalidate(self):
+        """Called on every knowledge base change"""
+        with self.lock:
+            self.kb_version += 1
+            self.entries.clear()
+            self.invalidations += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": ANSWER_CACHE_ENABLED,
+                "entries": len(self.entries),
+                "capacity": self.max_items,
+                "max_distance": self.max_distance,
+                "kb_version": self.kb_version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None
+            }
+
+answer_cache = SemanticAnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_MAX_DISTANCE, ANSWER_CACHE_TTL)
+
+# Core rulebook (Core-category documents assembled into the prompt's rulebook block)
+core_rulebook_cache: Dict[str, Any] = {"text": None, "version": 0, "hash": None, "chunks": 0, "built_at": None}
+core_rulebook_lock = threading.Lock()
+
+def build_core_rulebook() -> Tuple[str, int]:
+    """Assemble the rulebook from Core category chunks (Style Guide & Management Duties)"""
+    core_results = kb_collection.get(
+        where={"category": "Core"},
+        limit=10
+    )
+    
+    core_rulebook = ""
+    if core_results and core_results['documents']:
+        # Combine all Core doc chunks into rulebook
+        core_content = []
+        seen_titles = set()
+        for i, metadata in enumerate(core_results['metadatas']):
+            title = metadata.get('title', 'Core Document')
+            if title not in seen_titles:
+                seen_titles.add(title)
+                core_content.append(f"=== {title} ===")
+            core_content.append(core_results['documents'][i])
+        
+        core_rulebook = "\n".join(core_content)
+    return core_rulebook, len(core_results['ids']) if core_results else 0
+
+def get_core_rulebook() -> str:
+    """Cached Core rulebook, rebuilt only after Core documents change"""
+    with core_rulebook_lock:
+        if core_rulebook_cache["text"] is None:
+            text, chunks = build_core_rulebook()
+            core_rulebook_cache.update(
+                text=text,
+                version=core_rulebook_cache["version"] + 1,
+                hash=content_hash(text)[:12],
+                chunks=chunks,
+                built_at=time.time()
+            )
+            print(f"📘 Core rulebook built (version {core_rulebook_cache['version']}, {chunks} chunks)")
+        return core_rulebook_cache["text"]
+
+def core_rulebook_info() -> Dict[str, Any]:
+    with core_rulebook_lock:
+        return {key: value for key, value in core_rulebook_cache.items() if key != "text"}
+
+# Touched on every KB write so other processes (bulk_load.py, update_core_*.py, other
+# workers) invalidate their caches too; see sync_kb_changes
+KB_CHANGE_MARKER = Path(CHROMA_DB_PATH) / "kb_changed"
+kb_marker_seen: Optional[int] = None
+kb_sync_lock = threading.Lock()
+
+def kb_marker_mtime() -> int:
+    try:
+        return KB_CHANGE_MARKER.stat().st_mtime_ns
+    except OSError:
+        return 0
+
+def notify_kb_changed(core_changed: bool = False, broadcast: bool = True):
+    """Invalidate caches that depend on knowledge base contents
+    
+    core_changed: Core-category documents were added, recategorized or removed.
+    broadcast: touch KB_CHANGE_MARKER so other processes pick up the change.
+    """
+    global kb_marker_seen
+    answer_cache.invalidate()
+    if core_changed:
+        with core_rulebook_lock:
+            core_rulebook_cache["text"] = None
+    if broadcast:
+        with kb_sync_lock:
+            # A change by another process that sync_kb_changes has not picked up yet must
+            # stay visible to it, so only our own touch may advance kb_marker_seen
+            external_pending = kb_marker_seen is not None and kb_marker_mtime() != kb_marker_seen
+            try:
+                KB_CHANGE_MARKER.touch()
+                if not external_pending:
+                    kb_marker_seen = kb_marker_mtime()
+            except OSError as e:
+                print(f"⚠️ Could not touch {KB_CHANGE_MARKER}: {e}")
+
+def sync_kb_changes():
+    """Invalidate caches and rebuild the search indexes (in the background) if another
+    process changed the KB since we last looked"""
+    global kb_marker_seen
+    with kb_sync_lock:
+        mtime = kb_marker_mtime()
+        if kb_marker_seen is None:
+            kb_marker_seen = mtime
+            return
+        if mtime == kb_marker_seen:
+            return
+        kb_marker_seen = mtime
+        print("🔄 Knowledge base changed in another process, invalidating caches")
+        # Which documents changed is unknown, so the rulebook is rebuilt too
+        notify_kb_changed(core_changed=True, broadcast=False)
+        schedule_index_rebuild()
 
 # Pydantic models
 class ChatMessage(BaseModel):
@@ -294,24 +1734,47 @@ class ChatRequest(BaseModel):
     form_context: Optional[Dict[str, Any]] = None
     use_fallback: bool = False
     mode: str = "educator"  # 'educator' or 'internal'
+    search_mode: Optional[Literal["vector", "hybrid"]] = None  # defaults to SEARCH_MODE
+    diversify: Optional[bool] = None  # MMR + adjacent-chunk merging, defaults to SEARCH_DIVERSIFY
+    rerank: Optional[bool] = None  # cross-encoder reranking, defaults to RERANK_ENABLED
+    filters: Optional[Dict[str, Any]] = None  # KB metadata filters, combined with CHAT_MODE_FILTERS
+
+class KBBatchSearchRequest(BaseModel):
+    queries: List[str]
+    limit: int = 5
+    search_mode: Optional[Literal["vector", "hybrid"]] = None  # defaults to SEARCH_MODE
+    diversify: Optional[bool] = None  # MMR + adjacent-chunk merging, defaults to SEARCH_DIVERSIFY
+    rerank: Optional[bool] = None  # cross-encoder reranking, defaults to RERANK_ENABLED
+    category: Optional[Union[str, List[str]]] = None  # metadata filters, applied inside ChromaDB
+    doc_id: Optional[Union[str, List[str]]] = None
+    source: Optional[Union[str, List[str]]] = None
+    filters: Optional[Dict[str, Any]] = None  # any other metadata: {"key": value | [values] | {"$op": value}}
 
 class DocumentIngest(BaseModel):
     title: str
     content: str
     category: str
     metadata: Optional[Dict[str, Any]] = None
+    source_key: Optional[str] = None  # Stable key: re-ingesting the same key updates the document in place
 
 class KBSearchRequest(BaseModel):
     query: str
     limit: int = 5
+    search_mode: Optional[Literal["vector", "hybrid"]] = None  # defaults to SEARCH_MODE
+    diversify: Optional[bool] = None  # MMR + adjacent-chunk merging, defaults to SEARCH_DIVERSIFY
+    rerank: Optional[bool] = None  # cross-encoder reranking, defaults to RERANK_ENABLED
+    category: Optional[Union[str, List[str]]] = None  # metadata filters, applied inside ChromaDB
+    doc_id: Optional[Union[str, List[str]]] = None
+    source: Optional[Union[str, List[str]]] = None
+    filters: Optional[Dict[str, Any]] = None  # any other metadata: {"key": value | [values] | {"$op": value}}
 
 # Helper functions
-def fetch_user_context(user_id: int) -> Optional[Dict]:
+async def fetch_user_context(user_id: int) -> Optional[Dict]:
     """Fetch user context from Next.js API"""
     try:
-        response = requests.get(
-            f"http://localhost:3000/api/user/context?user_id={user_id}",
-            timeout=5
+        response = await get_http_client("app").get(
+            "/api/user/context",
+            params={"user_id": user_id}
         )
         if response.status_code == 200:
             return response.json()
@@ -320,34 +1783,78 @@ def fetch_user_context(user_id: int) -> Optional[Dict]:
         print(f"Error fetching user context: {e}")
         return None
 
-def save_conversation(user_id: int, query: str, response: str, mode: str = "educator"):
+async def save_conversation(user_id: int, query: str, response: str, mode: str = "educator"):
     """Save conversation to database via Next.js API"""
     try:
-        requests.post(
-            "http://localhost:3000/api/user/conversation/save",
+        await get_http_client("app").post(
+            "/api/user/conversation/save",
             json={
                 "user_id": user_id,
                 "query": query,
                 "response": response,
                 "mode": mode
-            },
-            timeout=5
+            }
         )
     except Exception as e:
         print(f"Error saving conversation: {e}")
 
-def extract_text_from_pdf(file_bytes: bytes) -> str:
-    """Extract text from PDF file"""
+def extract_pdf_page_range(file_bytes: bytes, start: int, end: int) -> List[str]:
+    """Extract text for pages [start, end) - runs inside a PDF worker process"""
+    import io
+    pdf = PdfReader(io.BytesIO(file_bytes))
+    return [(pdf.pages[i].extract_text() or "") for i in range(start, end)]
+
+def worker_mp_context():
+    """Start method for extraction worker pools: forkserver where available, else spawn
+    
+    Never fork: this process runs the start-up thread, the threadpool, torch/ONNX threads and
+    SQLite handles, and a forked copy can inherit their locks mid-use and deadlock. Workers
+    re-import main.py instead, which is cheap because the model and ChromaDB load lazily.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    """Lazily create the PDF extraction process pool"""
+    global pdf_executor
+    with pdf_executor_lock:
+        if pdf_executor is None:
+            pdf_executor = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=worker_mp_context())
+        return pdf_executor
+
+def extract_pages_from_pdf(file_bytes: bytes) -> List[str]:
+    """Extract per-page text from a PDF, fanning page ranges out to a process pool for large files"""
+    global pdf_executor
     import io
     try:
-        pdf = PdfReader(io.BytesIO(file_bytes))
-        text = ""
-        for page in pdf.pages:
-            text += page.extract_text() + "\n\n"
-        return text.strip()
+        page_count = len(PdfReader(io.BytesIO(file_bytes)).pages)
+        
+        if page_count < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS < 2:
+            return extract_pdf_page_range(file_bytes, 0, page_count)
+        
+        range_size = -(-page_count // PDF_EXTRACT_WORKERS)  # ceil division
+        ranges = [(start, min(start + range_size, page_count)) for start in range(0, page_count, range_size)]
+        
+        try:
+            executor = get_pdf_executor()
+            futures = [executor.submit(extract_pdf_page_range, file_bytes, start, end) for start, end in ranges]
+            pages = []
+            for future in futures:
+                pages.extend(future.result())
+            return pages
+        except Exception as pool_error:
+            # A broken pool (e.g. killed worker) must not fail the upload - retry serially
+            print(f"⚠️ Parallel PDF extraction failed ({pool_error}), extracting serially")
+            with pdf_executor_lock:
+                pdf_executor = None
+            return extract_pdf_page_range(file_bytes, 0, page_count)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
 
+def extract_text_from_pdf(file_bytes: bytes) -> str:
+    """Extract text from PDF file"""
+    return "\n\n".join(extract_pages_from_pdf(file_bytes)).strip()
+
 def extract_text_from_docx(file_bytes: bytes) -> str:
     """Extract text from DOCX file"""
     import io
@@ -375,66 +1882,891 @@ def extract_text_from_txt(file_bytes: bytes) -> str:
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error reading TXT: {str(e)}")
 
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-    """Split text into overlapping chunks"""
+def extract_segments(filename: str, file_bytes: bytes) -> List[str]:
+    """Extract text as a list of segments (one per page for PDFs) based on file extension"""
+    if filename.endswith('.pdf'):
+        return extract_pages_from_pdf(file_bytes)
+    elif filename.endswith('.docx'):
+        return [extract_text_from_docx(file_bytes)]
+    elif filename.endswith('.rtf'):
+        return [extract_text_from_rtf(file_bytes)]
+    elif filename.endswith('.txt'):
+        return [extract_text_from_txt(file_bytes)]
+    raise HTTPException(status_code=400, detail="Unsupported file type. Use PDF, DOCX, RTF, or TXT.")
+
+def extract_text(filename: str, file_bytes: bytes) -> str:
+    """Extract text based on file extension"""
+    return "\n\n".join(extract_segments(filename, file_bytes)).strip()
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)"""
+    return (len(text) + 3) // 4
+
+def chunk_fixed(segments: Iterable[str], chunk_size: int = 500, overlap: int = 50) -> List[Dict[str, Any]]:
+    """Legacy chunker: fixed-size character slices with overlap
+    
+    Segments are consumed incrementally and joined with paragraph breaks, so a long
+    document is never concatenated into one large string. Offsets are character positions
+    in "\n\n".join(segments), before any stripping.
+    """
+    step = chunk_size - overlap
     chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
+    buffer = ""
+    buffer_offset = 0
+    first = True
+    for segment in segments:
+        buffer += segment if first else "\n\n" + segment
+        first = False
+        while len(buffer) >= chunk_size:
+            chunk = buffer[:chunk_size]
+            if chunk.strip():
+                chunks.append({"text": chunk, "start_offset": buffer_offset, "end_offset": buffer_offset + len(chunk)})
+            buffer = buffer[step:]
+            buffer_offset += step
+    while buffer:
+        chunk = buffer[:chunk_size]
         if chunk.strip():
-            chunks.append(chunk)
-        start = end - overlap
+            chunks.append({"text": chunk, "start_offset": buffer_offset, "end_offset": buffer_offset + len(chunk)})
+        buffer = buffer[step:]
+        buffer_offset += step
     return chunks
 
-def search_knowledge_base(query: str, limit: int = 5) -> List[Dict[str, Any]]:
-    """Search ChromaDB for relevant documents with style guide prioritization"""
+def split_spans(text: str, separator: str, start: int, end: int) -> List[Tuple[int, int]]:
+    """Split text[start:end] on a regex separator, returning whitespace-trimmed (start, end) spans"""
+    spans = []
+    position = start
+    pieces = [(m.start(), m.end()) for m in re.compile(separator).finditer(text, start, end)]
+    for piece_end, next_start in pieces + [(end, end)]:
+        piece = text[position:piece_end]
+        stripped = piece.strip()
+        if stripped:
+            lead = len(piece) - len(piece.lstrip())
+            spans.append((position + lead, position + lead + len(stripped)))
+        position = next_start
+    return spans
+
+def structural_units(text: str, max_tokens: int) -> List[Tuple[int, int]]:
+    """Break text into the largest structural units that fit the budget
+    
+    Paragraphs are kept whole when they fit; otherwise they are split into lines, then
+    sentences, and only as a last resort into runs of words.
+    """
+    units = []
+    levels = [r"\n\s*\n", r"\n", r"(?<=[.!?])\s+"]
+    
+    def split(start: int, end: int, level: int):
+        if estimate_tokens(text[start:end]) <= max_tokens:
+            units.append((start, end))
+        elif level < len(levels):
+            for span_start, span_end in split_spans(text, levels[level], start, end):
+                split(span_start, span_end, level + 1)
+        else:
+            # Single over-long sentence: pack whole words up to the budget
+            run_start = run_end = None
+            for word in re.finditer(r"\S+", text[start:end]):
+                word_start, word_end = start + word.start(), start + word.end()
+                if run_start is not None and estimate_tokens(text[run_start:word_end]) > max_tokens:
+                    units.append((run_start, run_end))
+                    run_start = None
+                if estimate_tokens(text[word_start:word_end]) > max_tokens:
+                    # Unbroken run of characters (e.g. a URL or encoded blob): slice it
+                    if run_start is not None:
+                        units.append((run_start, run_end))
+                        run_start = None
+                    step = max_tokens * 4
+                    units.extend((i, min(i + step, word_end)) for i in range(word_start, word_end, step))
+                    continue
+                if run_start is None:
+                    run_start = word_start
+                run_end = word_end
+            if run_start is not None:
+                units.append((run_start, run_end))
+    
+    for span_start, span_end in split_spans(text, r"\n\s*\n", 0, len(text)):
+        split(span_start, span_end, 1)
+    return units
+
+def chunk_structured(
+    segments: Iterable[str],
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    min_tokens: int = CHUNK_MIN_TOKENS
+) -> List[Dict[str, Any]]:
+    """Pack whole paragraphs/sentences into chunks of up to max_tokens
+    
+    Uses the paragraph breaks produced by the extractors. Chunk text is the exact source
+    slice (segments such as PDF pages are joined with paragraph breaks). Offsets are
+    character positions in "\n\n".join(segments), before any stripping - not in the
+    stripped string extract_text returns.
+    """
+    # (segment, segment_index, start, end, segment_offset)
+    current: List[Tuple[str, int, int, int, int]] = []
+    
+    def render(units: List[Tuple[str, int, int, int, int]]) -> Dict[str, Any]:
+        parts = []
+        group_start = 0
+        for i in range(1, len(units) + 1):
+            if i == len(units) or units[i][1] != units[group_start][1]:
+                segment = units[group_start][0]
+                parts.append(segment[units[group_start][2]:units[i - 1][3]])
+                group_start = i
+        return {
+            "text": "\n\n".join(parts),
+            "start_offset": units[0][4] + units[0][2],
+            "end_offset": units[-1][4] + units[-1][3]
+        }
+    
+    chunk_units: List[List[Tuple[str, int, int, int, int]]] = []
+    segment_offset = 0
+    for segment_index, segment in enumerate(segments):
+        for start, end in structural_units(segment, max_tokens):
+            unit = (segment, segment_index, start, end, segment_offset)
+            candidate = current + [unit]
+            if current and estimate_tokens(render(candidate)["text"]) > max_tokens:
+                chunk_units.append(current)
+                current = [unit]
+            else:
+                current = candidate
+        segment_offset += len(segment) + 2  # "\n\n" between segments
+    
+    if current:
+        # Fold a tiny trailing chunk into the previous one rather than storing a fragment
+        if chunk_units and estimate_tokens(render(current)["text"]) < min_tokens:
+            merged = chunk_units[-1] + current
+            if estimate_tokens(render(merged)["text"]) <= max_tokens + min_tokens:
+                chunk_units[-1] = merged
+                current = []
+        if current:
+            chunk_units.append(current)
+    
+    return [render(units) for units in chunk_units]
+
+CHUNKERS: Dict[str, Callable[[Iterable[str]], List[Dict[str, Any]]]] = {
+    "structured": chunk_structured,
+    "fixed": chunk_fixed,
+}
+
+def chunk_document(content: Union[str, Iterable[str]], chunker: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Chunk a document with the configured chunker, returning text + offsets per chunk"""
+    name = chunker or CHUNKER
+    if name not in CHUNKERS:
+        raise ValueError(f"Unknown chunker '{name}'. Options: {', '.join(CHUNKERS)}")
+    segments = [content] if isinstance(content, str) else content
+    return CHUNKERS[name](segments)
+
+def chunk_text(text: Union[str, Iterable[str]], chunk_size: int = 500, overlap: int = 50) -> List[str]:
+    """Split text into overlapping fixed-size chunks (legacy chunker)"""
+    segments = [text] if isinstance(text, str) else text
+    return [chunk["text"] for chunk in chunk_fixed(segments, chunk_size, overlap)]
+
+def write_chunks(
+    ids: List[str],
+    embeddings: List[List[float]],
+    documents: List[str],
+    metadatas: List[Dict[str, Any]],
+    batch_size: int = CHROMA_WRITE_BATCH_SIZE,
+    on_progress: Optional[Callable[[int], None]] = None
+):
+    """Write chunks to ChromaDB in batched add calls"""
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        kb_collection.add(
+            ids=ids[start:end],
+            embeddings=embeddings[start:end],
+            documents=documents[start:end],
+            metadatas=metadatas[start:end]
+        )
+        index_chunks(ids[start:end], embeddings[start:end], documents[start:end], metadatas[start:end])
+        if on_progress:
+            on_progress(min(end, len(ids)))
+
+def content_hash(text: str) -> str:
+    """SHA-256 hex digest of a chunk of text"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def document_hash(content: Union[str, List[str]]) -> str:
+    """SHA-256 hex digest of a whole document (string or list of segments)"""
+    hasher = hashlib.sha256()
+    for segment in ([content] if isinstance(content, str) else content):
+        hasher.update(segment.encode('utf-8'))
+        hasher.update(b"\x00")
+    return hasher.hexdigest()
+
+def update_chunk_metadata(ids: List[str], metadatas: List[Dict[str, Any]], batch_size: int = CHROMA_WRITE_BATCH_SIZE):
+    """Replace chunk metadata in ChromaDB in batched calls (no re-embedding)
+    
+    collection.update merges metadata, so chunks that lose a key are deleted and re-added
+    with their stored embedding instead; both search engines then see the same metadata.
+    """
+    for start in range(0, len(ids), batch_size):
+        batch_ids, batch_metas = ids[start:start + batch_size], metadatas[start:start + batch_size]
+        stored = kb_collection.get(ids=batch_ids, include=["metadatas", "embeddings", "documents"])
+        rows = {
+            chunk_id: (meta or {}, embedding, document)
+            for chunk_id, meta, embedding, document in zip(
+                stored['ids'], stored['metadatas'], stored['embeddings'], stored['documents']
+            )
+        }
+        merge_ids, merge_metas, replace_ids, replace_metas = [], [], [], []
+        for chunk_id, meta in zip(batch_ids, batch_metas):
+            if chunk_id in rows and set(rows[chunk_id][0]) - set(meta):
+                replace_ids.append(chunk_id)
+                replace_metas.append(meta)
+            else:
+                merge_ids.append(chunk_id)
+                merge_metas.append(meta)
+        if merge_ids:
+            kb_collection.update(ids=merge_ids, metadatas=merge_metas)
+        if replace_ids:
+            kb_collection.delete(ids=replace_ids)
+            kb_collection.add(
+                ids=replace_ids,
+                embeddings=[rows[chunk_id][1] for chunk_id in replace_ids],
+                documents=[rows[chunk_id][2] for chunk_id in replace_ids],
+                metadatas=replace_metas
+            )
+        reindex_chunk_metadata(batch_ids, batch_metas)
+
+ingest_key_locks: Dict[str, List[Any]] = {}  # key -> [lock, holders + waiters]
+ingest_key_locks_guard = threading.Lock()
+
+@contextmanager
+def ingest_key_lock(key: str):
+    """Serialize ingests of one document (same source_key, or same content without one)"""
+    with ingest_key_locks_guard:
+        entry = ingest_key_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with ingest_key_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del ingest_key_locks[key]
+
+# Metadata ingest_text sets on every chunk (everything else comes from the upload)
+CHUNK_SYSTEM_METADATA = frozenset(
+    ("chunk_index", "start_offset", "end_offset", "chunker", "doc_id", "content_hash", "doc_hash", "source_key")
+)
+
+def metadata_matches(
+    stored: Dict[str, Any], title: str, category: str, metadata: Optional[Dict[str, Any]]
+) -> bool:
+    """True if a stored chunk carries exactly this upload's title, category and extra metadata
+    (a key dropped from the upload counts as a change)"""
+    expected = {"title": title, "category": category, **(metadata or {})}
+    return (
+        all(stored.get(key) == value for key, value in expected.items())
+        and set(stored) - CHUNK_SYSTEM_METADATA <= set(expected)
+    )
+
+def ingest_text(
+    title: str,
+    content: Union[str, List[str]],
+    category: str,
+    metadata: Optional[Dict[str, Any]] = None,
+    timings: Optional[Dict[str, float]] = None,
+    job: Optional[Dict[str, Any]] = None,
+    source_key: Optional[str] = None
+) -> Dict[str, Any]:
+    """Chunk, batch-embed and batch-write a document, recording per-stage timings (ms)
+    
+    content may be a string or a list of segments (e.g. PDF pages) streamed into the chunker.
+    If a background job record is passed, its stage and chunk counters are updated as work progresses.
+    
+    Every chunk is stored with its content hash. With a source_key, re-ingesting updates the
+    existing document in place: unchanged chunks are kept (metadata refreshed), only new or
+    changed chunks are embedded, and stale chunks are deleted. Identical uploads (same content,
+    title, category and metadata) are skipped entirely.
+    
+    Raises ValueError if metadata sets any of CHUNK_SYSTEM_METADATA (deduplication,
+    re-ingestion and deletes rely on those fields).
+    """
+    reserved = sorted(CHUNK_SYSTEM_METADATA.intersection(metadata or {}))
+    if reserved:
+        raise ValueError(f"Reserved metadata keys: {', '.join(reserved)}")
+    timings = timings if timings is not None else {}
+    doc_hash = document_hash(content)
+    
+    # Concurrent ingests of the same document would both pass the "unchanged" check and
+    # write duplicate chunks; the lock serializes them (within this process)
+    with ingest_key_lock(source_key or f"doc_hash:{doc_hash}"):
+        # Find the current version of this document
+        existing_ids: List[str] = []
+        existing_docs: List[str] = []
+        existing_metas: List[Dict[str, Any]] = []
+        if source_key:
+            existing = kb_collection.get(where={"source_key": source_key}, include=["metadatas", "documents"])
+            existing_ids = existing['ids'] or []
+            existing_docs = existing['documents'] or []
+            existing_metas = existing['metadatas'] or []
+        else:
+            existing = kb_collection.get(
+                where={"$and": [{"doc_hash": doc_hash}, {"title": title}, {"category": category}]},
+                include=["metadatas"]
+            )
+            match = next(
+                (m for m in existing['metadatas'] or [] if metadata_matches(m, title, category, metadata)), None
+            )
+            if match:
+                print(f"⏭️ Skipped '{title}': identical document already ingested")
+                return {
+                    "status": "unchanged",
+                    "doc_id": match.get('doc_id'),
+                    "chunks_created": 0,
+                    "chunks_reused": 0,
+                    "chunks_deleted": 0,
+                    "timings_ms": timings
+                }
+        
+        if existing_ids and all(
+            m.get('doc_hash') == doc_hash and metadata_matches(m, title, category, metadata)
+            for m in existing_metas
+        ):
+            print(f"⏭️ Skipped '{title}': source_key '{source_key}' is unchanged")
+            return {
+                "status": "unchanged",
+                "doc_id": existing_metas[0].get('doc_id'),
+                "chunks_created": 0,
+                "chunks_reused": len(existing_ids),
+                "chunks_deleted": 0,
+                "timings_ms": timings
+            }
+        
+        doc_id = existing_metas[0].get('doc_id') if existing_metas else str(uuid.uuid4())
+        
+        stage_start = time.perf_counter()
+        chunk_spans = chunk_document(content)
+        chunks = [chunk["text"] for chunk in chunk_spans]
+        timings["chunk"] = round((time.perf_counter() - stage_start) * 1000, 2)
+        
+        # Existing chunks by content hash (computed from stored text so older chunks without the field also match)
+        reusable: Dict[str, List[str]] = {}
+        for chunk_id, chunk_doc in zip(existing_ids, existing_docs):
+            reusable.setdefault(content_hash(chunk_doc), []).append(chunk_id)
+        
+        new_ids, new_chunks, new_metas = [], [], []
+        reused_ids, reused_metas = [], []
+        for i, chunk in enumerate(chunks):
+            chunk_hash = content_hash(chunk)
+            chunk_meta = {
+                "title": title,
+                "category": category,
+                "chunk_index": i,
+                "start_offset": chunk_spans[i]["start_offset"],
+                "end_offset": chunk_spans[i]["end_offset"],
+                "chunker": CHUNKER,
+                "doc_id": doc_id,
+                "content_hash": chunk_hash,
+                "doc_hash": doc_hash,
+                **({"source_key": source_key} if source_key else {}),
+                **(metadata or {})
+            }
+            if reusable.get(chunk_hash):
+                reused_ids.append(reusable[chunk_hash].pop())
+                reused_metas.append(chunk_meta)
+            else:
+                new_ids.append(
+                    f"{doc_id}_{chunk_hash[:16]}_{uuid.uuid4().hex[:8]}" if source_key else f"{doc_id}_chunk_{i}"
+                )
+                new_chunks.append(chunk)
+                new_metas.append(chunk_meta)
+        stale_ids = [chunk_id for ids in reusable.values() for chunk_id in ids]
+        
+        if job is not None:
+            update_ingest_job(job, status="embedding", chunks_total=len(new_chunks))
+        
+        stage_start = time.perf_counter()
+        embeddings = embed_texts(new_chunks)
+        timings["embed"] = round((time.perf_counter() - stage_start) * 1000, 2)
+        
+        if job is not None:
+            update_ingest_job(job, status="writing")
+        
+        stage_start = time.perf_counter()
+        write_chunks(
+            new_ids, embeddings, new_chunks, new_metas,
+            on_progress=(lambda written: update_ingest_job(job, chunks_written=written)) if job is not None else None
+        )
+        if reused_ids:
+            update_chunk_metadata(reused_ids, reused_metas)
+        if stale_ids:
+            kb_collection.delete(ids=stale_ids)
+            unindex_chunks(stale_ids)
+        notify_kb_changed(
+            core_changed=(category == "Core" or any(m.get('category') == "Core" for m in existing_metas))
+        )
+        timings["write"] = round((time.perf_counter() - stage_start) * 1000, 2)
+        
+        print(
+            f"📥 Ingested '{title}': {len(new_chunks)} new, {len(reused_ids)} reused, "
+            f"{len(stale_ids)} deleted chunks | timings(ms)={timings}"
+        )
+        
+        return {
+            "status": "success",
+            "doc_id": doc_id,
+            "chunks_created": len(new_chunks),
+            "chunks_reused": len(reused_ids),
+            "chunks_deleted": len(stale_ids),
+            "timings_ms": timings
+        }
+
+def update_ingest_job(job: Dict[str, Any], **fields):
+    """Update a background ingestion job record"""
+    with ingest_jobs_lock:
+        job.update(fields)
+
+def prune_ingest_jobs():
+    """Drop the oldest finished jobs beyond INGEST_JOB_HISTORY (caller holds ingest_jobs_lock)"""
+    finished = [j for j in ingest_jobs.values() if j["status"] in ("completed", "failed")]
+    excess = len(finished) - INGEST_JOB_HISTORY
+    if excess > 0:
+        finished.sort(key=lambda j: j["finished_at"])
+        for job in finished[:excess]:
+            del ingest_jobs[job["job_id"]]
+
+def run_ingest_job(
+    job: Dict[str, Any],
+    filename: str,
+    file_bytes: bytes,
+    category: str,
+    title: Optional[str],
+    source_key: Optional[str] = None
+):
+    """Worker: extract, chunk, embed and store an uploaded file for a background job"""
+    started = time.perf_counter()
+    update_ingest_job(job, status="extracting", started_at=time.time())
     try:
-        query_embedding = embedding_model.encode([query])[0].tolist()
+        timings = {}
+        stage_start = time.perf_counter()
+        content = extract_segments(filename, file_bytes)
+        timings["extract"] = round((time.perf_counter() - stage_start) * 1000, 2)
         
-        # Get more results initially (we'll prioritize and limit after)
-        results = kb_collection.query(
-            query_embeddings=[query_embedding],
-            n_results=limit * 2  # Get extra results to prioritize from
+        result = ingest_text(
+            title=title if title else filename,
+            content=content,
+            category=category,
+            metadata={"filename": filename},
+            timings=timings,
+            job=job,
+            source_key=source_key
         )
+        elapsed = time.perf_counter() - started
+        update_ingest_job(
+            job,
+            status="completed",
+            result=result["status"],
+            doc_id=result["doc_id"],
+            chunks_created=result["chunks_created"],
+            chunks_reused=result["chunks_reused"],
+            chunks_deleted=result["chunks_deleted"],
+            timings_ms=result["timings_ms"],
+            chunks_per_second=round(result["chunks_created"] / elapsed, 2) if elapsed > 0 else None
+        )
+    except Exception as e:
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        print(f"❌ Ingest job {job['job_id']} failed: {error}")
+        update_ingest_job(job, status="failed", error=error)
+    finally:
+        with ingest_jobs_lock:
+            job["finished_at"] = time.time()
+            job["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            prune_ingest_jobs()
+
+def submit_ingest_job(
+    filename: str,
+    file_bytes: bytes,
+    category: str,
+    title: Optional[str],
+    source_key: Optional[str] = None
+) -> Dict[str, Any]:
+    """Queue an uploaded file for background ingestion and return its job record"""
+    with ingest_jobs_lock:
+        pending = sum(1 for j in ingest_jobs.values() if j["status"] not in ("completed", "failed"))
+        if pending >= INGEST_MAX_PENDING:
+            raise HTTPException(status_code=429, detail="Ingestion queue is full. Please try again shortly.")
         
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "status": "queued",
+            "filename": filename,
+            "title": title if title else filename,
+            "category": category,
+            "source_key": source_key,
+            "bytes": len(file_bytes),
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "doc_id": None,
+            "chunks_total": None,
+            "chunks_written": 0,
+            "chunks_created": None,
+            "chunks_reused": None,
+            "chunks_deleted": None,
+            "chunks_per_second": None,
+            "timings_ms": None,
+            "duration_ms": None,
+            "error": None
+        }
+        ingest_jobs[job["job_id"]] = job
+    
+    ingest_executor.submit(run_ingest_job, job, filename, file_bytes, category, title, source_key)
+    return job
+
+def build_where(
+    category: Optional[Union[str, List[str]]] = None,
+    doc_id: Optional[Union[str, List[str]]] = None,
+    source: Optional[Union[str, List[str]]] = None,
+    filters: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    """Build a ChromaDB `where` clause from metadata filters (lists become $in, operators pass through)
+    
+    Raises ValueError for filters ChromaDB would reject.
+    """
+    from chromadb.api.types import validate_where
+    
+    conditions = []
+    fields = {"category": category, "doc_id": doc_id, "source": source, **(filters or {})}
+    for key, value in fields.items():
+        if value is None:
+            continue
+        if isinstance(value, list):
+            value = {"$in": value}
+        conditions.append({key: value})
+    
+    if not conditions:
+        return None
+    where = conditions[0] if len(conditions) == 1 else {"$and": conditions}
+    return validate_where(where)
+
+def vector_search(
+    query_embeddings: List[List[float]],
+    n_results: int,
+    with_embeddings: bool = False,
+    where: Optional[Dict[str, Any]] = None
+) -> List[List[Dict[str, Any]]]:
+    """Dense retrieval candidates for each query in one ChromaDB call (relevance = cosine similarity)"""
+    include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_embeddings else [])
+    engine = exact_index if exact_index is not None else kb_collection
+    results = engine.query(
+        query_embeddings=query_embeddings,
+        n_results=n_results,
+        include=include,
+        **({"where": where} if where else {})
+    )
+    
+    per_query = []
+    for q in range(len(query_embeddings)):
         documents = []
-        style_guide_docs = []
-        
         if results['documents']:
-            for i, doc in enumerate(results['documents'][0]):
-                metadata = results['metadatas'][0][i] if results['metadatas'] else {}
-                distance = results['distances'][0][i] if results['distances'] else 0
-                
-                doc_entry = {
+            for i, doc in enumerate(results['documents'][q]):
+                metadata = results['metadatas'][q][i] if results['metadatas'] else {}
+                distance = results['distances'][q][i] if results['distances'] else 0
+                documents.append({
+                    "id": results['ids'][q][i],
                     "content": doc,
                     "metadata": metadata,
-                    "distance": distance
-                }
-                
-                # Check if this is from Luna Style Guide
-                title = metadata.get('title', '').lower()
-                filename = metadata.get('filename', '').lower()
-                
-                if 'luna style guide' in title or 'luna style guide' in filename:
-                    # Boost style guide by reducing distance (making it more relevant)
-                    doc_entry['distance'] = distance * 0.5  # 50% boost
-                    style_guide_docs.append(doc_entry)
-                else:
-                    documents.append(doc_entry)
-        
-        # Prioritize: Style guide docs first, then others
-        prioritized_docs = style_guide_docs + documents
-        
-        # Sort by distance (lower is more relevant) and limit
-        prioritized_docs.sort(key=lambda x: x['distance'])
-        return prioritized_docs[:limit]
+                    "distance": distance,
+                    "relevance": max(0.0, 1 - distance)
+                })
+                if with_embeddings:
+                    documents[-1]["embedding"] = results['embeddings'][q][i]
+        per_query.append(documents)
+    return per_query
+
+def fuse_rankings(query: str, vector_docs: List[Dict[str, Any]], n_results: int) -> List[Dict[str, Any]]:
+    """Fuse BM25 and vector candidates with reciprocal rank fusion (relevance = RRF score)
+    
+    Lexical-only hits come back without content/metadata - see fill_chunk_contents.
+    """
+    lexical_hits = lexical_index.search(query, n_results)
+    
+    fused: Dict[str, Dict[str, Any]] = {}
+    for rank, doc in enumerate(vector_docs):
+        fused[doc["id"]] = dict(doc, bm25=None, relevance=1.0 / (HYBRID_RRF_K + rank + 1))
+    for rank, (chunk_id, bm25) in enumerate(lexical_hits):
+        entry = fused.setdefault(chunk_id, {"id": chunk_id, "distance": None, "relevance": 0.0})
+        entry["bm25"] = round(bm25, 4)
+        entry["relevance"] += 1.0 / (HYBRID_RRF_K + rank + 1)
+    return list(fused.values())
+
+def fill_chunk_contents(
+    candidate_lists: List[List[Dict[str, Any]]],
+    with_embeddings: bool = False,
+    where: Optional[Dict[str, Any]] = None
+) -> List[List[Dict[str, Any]]]:
+    """Fetch text and metadata (and embeddings) for lexical-only hits in a single ChromaDB get
+    
+    Hits that do not match the metadata filter are dropped.
+    """
+    missing = list(dict.fromkeys(
+        entry["id"] for candidates in candidate_lists for entry in candidates if "content" not in entry
+    ))
+    if missing:
+        include = ["documents", "metadatas"] + (["embeddings"] if with_embeddings else [])
+        found = kb_collection.get(ids=missing, include=include, **({"where": where} if where else {}))
+        chunks = {}
+        for i, chunk_id in enumerate(found['ids']):
+            chunks[chunk_id] = {"content": found['documents'][i], "metadata": found['metadatas'][i] or {}}
+            if with_embeddings:
+                chunks[chunk_id]["embedding"] = found['embeddings'][i]
+        for candidates in candidate_lists:
+            for entry in candidates:
+                if "content" not in entry and entry["id"] in chunks:
+                    entry.update(chunks[entry["id"]])
+    return [[entry for entry in candidates if "content" in entry] for candidates in candidate_lists]
+
+def result_weight(metadata: Dict[str, Any]) -> float:
+    """Scoring weight for a chunk: category weight x document weight"""
+    category_weight = SCORE_CATEGORY_WEIGHTS.get(metadata.get('category'), 1.0)
+    
+    # A weight stored with the document wins over the configured per-document weights
+    document_weight = metadata.get('score_weight')
+    if document_weight is None:
+        document_weight = SCORE_DOCUMENT_WEIGHTS.get(
+            metadata.get('source_key'), SCORE_DOCUMENT_WEIGHTS.get(metadata.get('doc_id'), 1.0)
+        )
+    return category_weight * float(document_weight)
+
+def score_results(candidates: List[Dict[str, Any]], limit: Optional[int]) -> List[Dict[str, Any]]:
+    """Weight candidates by category/document, dedupe by chunk id and keep the top `limit`"""
+    scored: Dict[str, Dict[str, Any]] = {}
+    for candidate in candidates:
+        if candidate["id"] in scored:
+            continue
+        weight = result_weight(candidate["metadata"])
+        scored[candidate["id"]] = dict(
+            candidate,
+            weight=weight,
+            score=round(candidate["relevance"] * weight, 6)
+        )
+    
+    ranked = sorted(scored.values(), key=lambda x: x["score"], reverse=True)
+    return ranked[:limit]
+
+def merge_chunk_run(run: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge consecutive chunks of one document into a single passage, dropping overlapping text"""
+    run = sorted(run, key=lambda x: x["metadata"]["chunk_index"])
+    content = run[0]["content"]
+    for prev, chunk in zip(run, run[1:]):
+        overlap = 0
+        if "end_offset" in prev["metadata"] and "start_offset" in chunk["metadata"]:
+            overlap = max(0, prev["metadata"]["end_offset"] - chunk["metadata"]["start_offset"])
+        content += ("" if overlap else "\n\n") + chunk["content"][overlap:]
+    
+    distances = [chunk["distance"] for chunk in run if chunk.get("distance") is not None]
+    return dict(
+        run[0],
+        content=content,
+        chunk_ids=[chunk["id"] for chunk in run],
+        distance=min(distances) if distances else None,
+        score=max(chunk["score"] for chunk in run)
+    )
+
+def diversify_results(ranked: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """Select chunks by maximal marginal relevance until they form `limit` passages, then merge
+    neighbours into those passages
+    
+    Candidates at least DEDUP_MIN_SIMILARITY similar to a selected chunk are dropped as
+    near-duplicates (overlapping slices, re-ingested copies). A candidate that would grow a
+    passage beyond DIVERSIFY_MAX_PASSAGE_CHUNKS is skipped, which bounds the result size.
+    """
+    if not ranked:
+        return []
+    vectors = np.asarray([entry["embedding"] for entry in ranked], dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    top_score = ranked[0]["score"] or 1.0
+    relevance = np.asarray([entry["score"] / top_score for entry in ranked], dtype=np.float32)
+    
+    def document_key(entry: Dict[str, Any]) -> Any:
+        return entry["metadata"].get("doc_id") if entry["metadata"].get("chunk_index") is not None else entry["id"]
+    
+    def run_length(key: Any, chunk_index: int, step: int) -> int:
+        """Selected chunks directly before (step=-1) or after (step=1) chunk_index"""
+        length = 0
+        while (key, chunk_index + step * (length + 1)) in positions:
+            length += 1
+        return length
+    
+    selected: List[int] = []
+    positions = set()
+    passage_count = 0
+    max_similarity = np.full(len(ranked), -1.0, dtype=np.float32)
+    available = np.ones(len(ranked), dtype=bool)
+    while passage_count < limit and available.any():
+        mmr = MMR_LAMBDA * relevance - (1 - MMR_LAMBDA) * np.maximum(max_similarity, 0)
+        best = int(np.argmax(np.where(available, mmr, -np.inf)))
+        available[best] = False
         
+        # A chunk next to already selected chunks of its document joins (or bridges) their passages
+        key, chunk_index = document_key(ranked[best]), ranked[best]["metadata"].get("chunk_index")
+        if chunk_index is not None:
+            before, after = run_length(key, chunk_index, -1), run_length(key, chunk_index, 1)
+            if before + after + 1 > DIVERSIFY_MAX_PASSAGE_CHUNKS:
+                continue
+            passage_count -= bool(before) + bool(after)
+            positions.add((key, chunk_index))
+        passage_count += 1
+        selected.append(best)
+        max_similarity = np.maximum(max_similarity, vectors @ vectors[best])
+        available &= max_similarity < DEDUP_MIN_SIMILARITY
+    
+    # Merge chunks of the same document with consecutive chunk_index into one passage
+    by_document: Dict[Any, List[Dict[str, Any]]] = {}
+    for index in selected:
+        entry = {key: value for key, value in ranked[index].items() if key != "embedding"}
+        by_document.setdefault(document_key(entry), []).append(entry)
+    
+    passages = []
+    for chunks in by_document.values():
+        chunks.sort(key=lambda x: x["metadata"].get("chunk_index", 0))
+        run = [chunks[0]]
+        for chunk in chunks[1:]:
+            if chunk["metadata"]["chunk_index"] == run[-1]["metadata"]["chunk_index"] + 1:
+                run.append(chunk)
+            else:
+                passages.append(run)
+                run = [chunk]
+        passages.append(run)
+    
+    merged = [merge_chunk_run(run) if len(run) > 1 else run[0] for run in passages]
+    merged.sort(key=lambda x: x["score"], reverse=True)
+    return merged
+
+def init_reranker():
+    """Load the cross-encoder used by the optional reranking stage"""
+    global rerank_model
+    from sentence_transformers import CrossEncoder
+    
+    print(f"Loading reranker: {RERANK_MODEL_NAME}...")
+    rerank_model = CrossEncoder(RERANK_MODEL_NAME)
+    
+    # One throwaway pass so the first request is not paying for lazy initialisation
+    rerank_model.predict([("warm up", "warm up")], show_progress_bar=False)
+    print("✅ Reranker ready")
+
+def rerank_results(
+    queries: List[str],
+    ranked_lists: List[List[Dict[str, Any]]]
+) -> Tuple[List[List[Dict[str, Any]]], Dict[str, Any]]:
+    """Rescore the top RERANK_CANDIDATES of each list with the cross-encoder
+    
+    Runs on a single worker under a RERANK_BUDGET_MS deadline. If the model is not loaded,
+    is still busy with an earlier request, fails or overruns, the first-stage order is kept.
+    New score = sigmoid(cross-encoder logit) x the chunk's category/document weight.
+    """
+    heads = [ranked[:RERANK_CANDIDATES] for ranked in ranked_lists]
+    pairs = [(query, entry["content"]) for query, head in zip(queries, heads) for entry in head]
+    info: Dict[str, Any] = {"status": "applied", "candidates": len(pairs), "budget_ms": RERANK_BUDGET_MS, "ms": 0.0}
+    
+    if rerank_model is None:
+        info["status"] = "unavailable"
+        return ranked_lists, info
+    if not pairs:
+        return ranked_lists, info
+    if not rerank_idle.acquire(blocking=False):
+        info["status"] = "busy"
+        return ranked_lists, info
+    
+    def predict():
+        try:
+            return rerank_model.predict(pairs, batch_size=RERANK_BATCH_SIZE, show_progress_bar=False)
+        finally:
+            rerank_idle.release()
+    
+    started = time.perf_counter()
+    future = rerank_executor.submit(predict)
+    try:
+        logits = np.asarray(future.result(timeout=RERANK_BUDGET_MS / 1000), dtype=np.float32)
+    except FuturesTimeout:
+        info["status"] = "timeout"
+        return ranked_lists, info
+    except Exception as e:
+        print(f"Error reranking: {e}")
+        info["status"] = "error"
+        return ranked_lists, info
+    finally:
+        info["ms"] = round((time.perf_counter() - started) * 1000, 2)
+    
+    probabilities = 1 / (1 + np.exp(-logits))
+    reranked_lists = []
+    offset = 0
+    for head, ranked in zip(heads, ranked_lists):
+        rescored = []
+        for entry, probability in zip(head, probabilities[offset:offset + len(head)]):
+            rescored.append(dict(
+                entry,
+                first_stage_score=entry["score"],
+                rerank_score=round(float(probability), 6),
+                score=round(float(probability) * entry["weight"], 6)
+            ))
+        offset += len(head)
+        rescored.sort(key=lambda x: x["score"], reverse=True)
+        reranked_lists.append(rescored + ranked[len(head):])
+    return reranked_lists, info
+
+def search_knowledge_base_batch(
+    queries: List[str],
+    limit: int = 5,
+    search_mode: Optional[str] = None,
+    diversify: Optional[bool] = None,
+    where: Optional[Dict[str, Any]] = None,
+    rerank: Optional[bool] = None,
+    debug: Optional[Dict[str, Any]] = None
+) -> List[List[Dict[str, Any]]]:
+    """Search for many queries at once: one encode batch and one multi-query ChromaDB call
+    
+    where: ChromaDB metadata filter (see build_where) applied inside the vector store.
+    debug: if given, filled with per-request details (rerank status and timing).
+    """
+    if not queries:
+        return []
+    sync_kb_changes()
+    diversify = SEARCH_DIVERSIFY if diversify is None else diversify
+    rerank = RERANK_ENABLED if rerank is None else rerank
+    query_embeddings = embed_queries(queries)
+    
+    # Get more candidates than needed so weighting (and MMR/reranking) can promote lower-ranked chunks.
+    # Near-duplicate removal and merging consume candidates, so diversifying needs a deeper pool.
+    pool = max(limit * 4, DIVERSIFY_CANDIDATES) if diversify else limit * 2
+    if rerank:
+        pool = max(pool, RERANK_CANDIDATES)
+    candidate_lists = vector_search(query_embeddings, pool, with_embeddings=diversify, where=where)
+    if (search_mode or SEARCH_MODE) == "hybrid":
+        candidate_lists = fill_chunk_contents([
+            fuse_rankings(query, vector_docs, pool)
+            for query, vector_docs in zip(queries, candidate_lists)
+        ], with_embeddings=diversify, where=where)
+    
+    ranked_lists = [score_results(candidates, None) for candidates in candidate_lists]
+    if rerank:
+        ranked_lists, rerank_info = rerank_results(queries, ranked_lists)
+        if debug is not None:
+            debug["rerank"] = rerank_info
+    
+    if diversify:
+        return [diversify_results(ranked, limit) for ranked in ranked_lists]
+    return [ranked[:limit] for ranked in ranked_lists]
+
+def search_knowledge_base(
+    query: str,
+    limit: int = 5,
+    search_mode: Optional[str] = None,
+    diversify: Optional[bool] = None,
+    where: Optional[Dict[str, Any]] = None,
+    rerank: Optional[bool] = None,
+    debug: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """Search ChromaDB for relevant documents ("vector" or "hybrid" retrieval), weighted by score_results"""
+    try:
+        return search_knowledge_base_batch([query], limit, search_mode, diversify, where, rerank, debug)[0]
     except Exception as e:
         print(f"Error searching KB: {e}")
         return []
 
-def call_ollama(messages: List[Dict[str, str]], system_prompt: str, timeout: int = 180) -> str:
+async def call_ollama(messages: List[Dict[str, str]], system_prompt: str, timeout: float = OLLAMA_READ_TIMEOUT) -> str:
     """Call Ollama llama3:8b for chat completion with extended timeout for cold starts"""
     try:
         # Format messages for Ollama
@@ -443,14 +2775,15 @@ def call_ollama(messages: List[Dict[str, str]], system_prompt: str, timeout: int
         
         print(f"Calling Ollama with timeout={timeout}s...")
         
-        response = requests.post(
-            f"{OLLAMA_URL}/api/chat",
+        response = await get_http_client("ollama").post(
+            "/api/chat",
             json={
                 "model": "llama3:8b",
                 "messages": formatted_messages,
-                "stream": False
+                "stream": False,
+                "options": {"num_ctx": OLLAMA_NUM_CTX}
             },
-            timeout=timeout  # Extended timeout for first query cold-start
+            timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT)  # Extended read timeout for first query cold-start
         )
         
         if response.status_code == 200:
@@ -459,14 +2792,14 @@ def call_ollama(messages: List[Dict[str, str]], system_prompt: str, timeout: int
             return content
         else:
             raise Exception(f"Ollama error: {response.text}")
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         print(f"Ollama timeout after {timeout}s - cold start issue")
         raise Exception(f"Luna is warming up (first query can take 2-3 minutes). Please try again!")
     except Exception as e:
         print(f"Ollama error: {e}")
         raise
 
-def call_openai_fallback(messages: List[Dict[str, str]], system_prompt: str) -> str:
+async def call_openai_fallback(messages: List[Dict[str, str]], system_prompt: str) -> str:
     """Fallback to OpenAI GPT-4 if Ollama fails"""
     if not OPENAI_API_KEY:
         raise Exception("OpenAI API key not configured")
@@ -475,8 +2808,8 @@ def call_openai_fallback(messages: List[Dict[str, str]], system_prompt: str) ->
         formatted_messages = [{"role": "system", "content": system_prompt}]
         formatted_messages.extend(messages)
         
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
+        response = await get_http_client("openai").post(
+            "/v1/chat/completions",
             headers={
                 "Authorization": f"Bearer {OPENAI_API_KEY}",
                 "Content-Type": "application/json"
@@ -486,8 +2819,7 @@ def call_openai_fallback(messages: List[Dict[str, str]], system_prompt: str) ->
                 "messages": formatted_messages,
                 "temperature": 0.7,
                 "max_tokens": 500
-            },
-            timeout=30
+            }
         )
         
         if response.status_code == 200:
@@ -498,6 +2830,439 @@ def call_openai_fallback(messages: List[Dict[str, str]], system_prompt: str) ->
         print(f"OpenAI error: {e}")
         raise
 
+async def stream_ollama(messages: List[Dict[str, str]], system_prompt: str, timeout: float = OLLAMA_READ_TIMEOUT):
+    """Stream llama3:8b tokens from Ollama's /api/chat (newline-delimited JSON)"""
+    formatted_messages = [{"role": "system", "content": system_prompt}]
+    formatted_messages.extend(messages)
+    
+    try:
+        async with get_http_client("ollama").stream(
+            "POST",
+            "/api/chat",
+            json={
+                "model": "llama3:8b",
+                "messages": formatted_messages,
+                "stream": True,
+                "options": {"num_ctx": OLLAMA_NUM_CTX}
+            },
+            timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT)
+        ) as response:
+            if response.status_code != 200:
+                raise Exception(f"Ollama error: {(await response.aread()).decode(errors='replace')}")
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise Exception(f"Ollama error: {chunk['error']}")
+                token = chunk.get("message", {}).get("content")
+                if token:
+                    yield token
+                if chunk.get("done"):
+                    break
+    except httpx.TimeoutException:
+        print(f"Ollama timeout after {timeout}s - cold start issue")
+        raise Exception("Luna is warming up (first query can take 2-3 minutes). Please try again!")
+
+async def stream_openai(messages: List[Dict[str, str]], system_prompt: str):
+    """Stream GPT-4o tokens from OpenAI's chat completions (server-sent events)"""
+    if not OPENAI_API_KEY:
+        raise Exception("OpenAI API key not configured")
+    
+    formatted_messages = [{"role": "system", "content": system_prompt}]
+    formatted_messages.extend(messages)
+    
+    async with get_http_client("openai").stream(
+        "POST",
+        "/v1/chat/completions",
+        headers={
+            "Authorization": f"Bearer {OPENAI_API_KEY}",
+            "Content-Type": "application/json"
+        },
+        json={
+            "model": "gpt-4o",
+            "messages": formatted_messages,
+            "temperature": 0.7,
+            "max_tokens": 500,
+            "stream": True
+        }
+    ) as response:
+        if response.status_code != 200:
+            raise Exception(f"OpenAI error: {(await response.aread()).decode(errors='replace')}")
+        async for line in response.aiter_lines():
+            if not line or not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or [{}]
+            token = choices[0].get("delta", {}).get("content")
+            if token:
+                yield token
+
+class ProviderStats:
+    """Recent latency and outcome counters for one LLM provider"""
+    
+    def __init__(self, window: int):
+        # ms; cancelled (hedged-out) attempts add their elapsed time as a lower-bound sample
+        self.latencies: deque = deque(maxlen=window)  # full completions (/chat)
+        self.first_token_latencies: deque = deque(maxlen=window)  # time to first token (/chat/stream)
+        self.counts = {"successes": 0, "failures": 0, "cancelled": 0, "hedged": 0, "wins": 0}
+    
+    def record(self, outcome: str, latency_ms: Optional[float] = None, first_token: bool = False):
+        self.counts[outcome] += 1
+        if latency_ms is not None:
+            (self.first_token_latencies if first_token else self.latencies).append(latency_ms)
+    
+    def percentile(self, q: float, first_token: bool = False) -> Optional[float]:
+        samples = self.first_token_latencies if first_token else self.latencies
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(samples, q))
+    
+    def stats(self) -> Dict[str, Any]:
+        summary: Dict[str, Any] = dict(self.counts)
+        for name, samples in (("latency_ms", self.latencies), ("first_token_ms", self.first_token_latencies)):
+            summary[name] = {
+                "samples": len(samples),
+                "p50": round(float(np.percentile(samples, 50)), 1) if samples else None,
+                "p95": round(float(np.percentile(samples, 95)), 1) if samples else None
+            }
+        return summary
+
+llm_stats: Dict[str, ProviderStats] = {
+    "openai": ProviderStats(LLM_STATS_WINDOW),
+    "ollama": ProviderStats(LLM_STATS_WINDOW),
+}
+
+class CircuitBreaker:
+    """closed -> open after repeated failures -> half_open (background probe) -> closed/open"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.outcomes: deque = deque(maxlen=BREAKER_WINDOW)  # True = success
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.last_error: Optional[str] = None
+        self.counts = {"opened": 0, "probes": 0, "probe_failures": 0}
+    
+    def allows(self) -> bool:
+        return not BREAKER_ENABLED or self.state == "closed"
+    
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+    
+    def record_success(self, latency_ms: Optional[float] = None):
+        if BREAKER_SLOW_CALL_MS and latency_ms is not None and latency_ms > BREAKER_SLOW_CALL_MS:
+            self.record_failure(f"slow call ({latency_ms / 1000:.1f}s)")
+            return
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        if self.state != "closed":
+            self.close()
+    
+    def record_failure(self, error: str):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        self.last_error = error
+        if self.state == "closed" and (
+            self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD
+            or (len(self.outcomes) == self.outcomes.maxlen and self.error_rate() >= BREAKER_ERROR_RATE)
+        ):
+            self.open()
+    
+    def open(self):
+        if self.state == "closed":
+            self.counts["opened"] += 1
+            print(f"⚡ {self.name} circuit opened: {self.last_error}")
+        self.state = "open"
+        self.opened_at = time.monotonic()
+    
+    def close(self):
+        print(f"✅ {self.name} circuit closed")
+        self.state = "closed"
+        self.outcomes.clear()
+        self.consecutive_failures = 0
+    
+    def due_probe(self) -> bool:
+        return self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS
+    
+    def info(self) -> Dict[str, Any]:
+        return {
+            "state": self.state if BREAKER_ENABLED else "disabled",
+            "consecutive_failures": self.consecutive_failures,
+            "error_rate": round(self.error_rate(), 3),
+            "recent_calls": len(self.outcomes),
+            "retry_in_s": round(max(BREAKER_OPEN_SECONDS - (time.monotonic() - self.opened_at), 0), 1)
+                if self.state == "open" else None,
+            "last_error": self.last_error,
+            "p95_latency_ms": llm_stats[self.name].stats()["latency_ms"]["p95"],
+            **self.counts
+        }
+
+breakers: Dict[str, CircuitBreaker] = {
+    "openai": CircuitBreaker("openai"),
+    "ollama": CircuitBreaker("ollama"),
+}
+breaker_probe_task: Optional["asyncio.Task"] = None
+
+async def probe_provider(provider: str):
+    """Cheap liveness request (no tokens generated); raises if the provider is not usable"""
+    if provider == "ollama":
+        response = await get_http_client("ollama").get("/api/tags", timeout=HTTP_CONNECT_TIMEOUT)
+    else:
+        if not OPENAI_API_KEY:
+            raise Exception("OpenAI API key not configured")
+        response = await get_http_client("openai").get(
+            "/v1/models",
+            headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+            timeout=HTTP_CONNECT_TIMEOUT
+        )
+    if response.status_code != 200:
+        raise Exception(f"{provider} probe returned {response.status_code}")
+
+async def probe_due_breakers():
+    """Half-open each breaker whose open period has elapsed and probe it: close on success, re-open on failure"""
+    for provider, breaker in breakers.items():
+        if not breaker.due_probe():
+            continue
+        breaker.state = "half_open"
+        breaker.counts["probes"] += 1
+        try:
+            await probe_provider(provider)
+        except Exception as e:
+            breaker.counts["probe_failures"] += 1
+            breaker.last_error = f"probe: {e}"
+            breaker.open()
+        else:
+            breaker.close()
+
+async def probe_open_breakers():
+    """Background loop: probe due breakers every BREAKER_PROBE_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(BREAKER_PROBE_INTERVAL)
+        await probe_due_breakers()
+
+@app.on_event("startup")
+async def start_breaker_probes():
+    global breaker_probe_task
+    if BREAKER_ENABLED:
+        breaker_probe_task = asyncio.create_task(probe_open_breakers())
+
+@app.on_event("shutdown")
+async def stop_breaker_probes():
+    if breaker_probe_task is not None:
+        breaker_probe_task.cancel()
+
+LLM_CALLS = {"openai": call_openai_fallback, "ollama": call_ollama}
+LLM_STREAMS = {"openai": stream_openai, "ollama": stream_ollama}
+
+def provider_order(use_fallback: bool) -> Tuple[str, str]:
+    """(primary, alternate): OpenAI first unless Ollama was requested"""
+    return ("ollama", "openai") if use_fallback else ("openai", "ollama")
+
+def hedge_delay(provider: str, first_token: bool = False) -> float:
+    """Seconds to wait on a provider before hedging with the alternate"""
+    observed = llm_stats[provider].percentile(HEDGE_PERCENTILE, first_token)
+    if observed is None:
+        return HEDGE_DEFAULT_DELAY_MS / 1000
+    return min(max(observed, HEDGE_MIN_DELAY_MS), HEDGE_MAX_DELAY_MS) / 1000
+
+async def race_providers(
+    start: Callable[[str], "asyncio.Task"],
+    use_fallback: bool,
+    first_token: bool = False
+) -> Tuple[str, Any]:
+    """Run the primary provider; start the alternate when it fails or (hedging) is slow
+    
+    start(provider) returns a task for one attempt. Returns (provider, result) of the first
+    success and cancels the other attempt; raises if both fail. A provider whose circuit is
+    open is skipped while the other one is available.
+    """
+    primary, alternate = provider_order(use_fallback)
+    if not breakers[primary].allows() and breakers[alternate].allows():
+        print(f"⚡ {primary} circuit open, routing to {alternate}")
+        primary, alternate = alternate, primary
+    skip_alternate = not breakers[alternate].allows()
+    print(f"{'Streaming from' if first_token else 'Using'} {primary} (primary)...")
+    tasks = {start(primary): primary}
+    pending = set(tasks)
+    timeout = hedge_delay(primary, first_token) if LLM_HEDGING and not skip_alternate else None
+    errors: Dict[str, Exception] = {}
+    hedged = False
+    
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            timeout = None
+            if not done:
+                # Primary is slower than its usual p95 - race the alternate
+                print(f"{primary} slower than {hedge_delay(primary, first_token):.1f}s, hedging with {alternate}...")
+                llm_stats[primary].record("hedged")
+                hedged = True
+                task = start(alternate)
+                tasks[task] = alternate
+                pending.add(task)
+                continue
+            for task in done:
+                if task.exception() is None:
+                    if hedged:
+                        llm_stats[tasks[task]].record("wins")
+                    return tasks[task], task.result()
+                errors[tasks[task]] = task.exception()
+            if alternate not in tasks.values() and alternate not in errors:
+                if skip_alternate:
+                    errors[alternate] = Exception("circuit open")
+                    continue
+                print(f"Primary LLM failed ({errors[primary]}), trying alternate...")
+                task = start(alternate)
+                tasks[task] = alternate
+                pending.add(task)
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    
+    raise Exception("Both LLMs failed. " + ", ".join(f"{name}: {error}" for name, error in errors.items()))
+
+async def timed_call(provider: str, messages: List[Dict[str, str]], system_prompt: str) -> str:
+    """One non-streaming LLM call, recorded in llm_stats"""
+    started = time.perf_counter()
+    try:
+        content = await LLM_CALLS[provider](messages, system_prompt)
+    except asyncio.CancelledError:
+        # Lost a hedged race: the elapsed time is a lower bound on its latency, so the
+        # hedge delay keeps seeing the slow tail instead of only calls that finished
+        llm_stats[provider].record("cancelled", (time.perf_counter() - started) * 1000)
+        raise
+    except Exception as e:
+        llm_stats[provider].record("failures")
+        breakers[provider].record_failure(str(e))
+        raise
+    latency_ms = (time.perf_counter() - started) * 1000
+    llm_stats[provider].record("successes", latency_ms)
+    breakers[provider].record_success(latency_ms)
+    return content
+
+async def generate_reply(prompts: Dict[str, Dict[str, Any]], use_fallback: bool) -> Tuple[str, str]:
+    """Complete a chat with primary/alternate routing (and hedging if enabled): (content, provider)
+    
+    prompts holds each provider's fitted {"system_prompt", "messages"} (see fit_prompt).
+    """
+    provider, content = await race_providers(
+        lambda name: asyncio.create_task(timed_call(name, prompts[name]["messages"], prompts[name]["system_prompt"])),
+        use_fallback
+    )
+    return content, provider
+
+async def open_stream(prompts: Dict[str, Dict[str, Any]], use_fallback: bool):
+    """Start a token stream, racing/falling back until one provider produces its first token
+    
+    Returns (provider, first token or None for an empty reply, remaining token iterator).
+    """
+    streams: Dict[str, Any] = {}
+    
+    async def first_token(provider: str) -> Optional[str]:
+        started = time.perf_counter()
+        streams[provider] = LLM_STREAMS[provider](prompts[provider]["messages"], prompts[provider]["system_prompt"])
+        try:
+            token = await streams[provider].__anext__()
+        except StopAsyncIteration:
+            token = None
+        except asyncio.CancelledError:
+            llm_stats[provider].record("cancelled", (time.perf_counter() - started) * 1000, first_token=True)
+            raise
+        except Exception as e:
+            llm_stats[provider].record("failures")
+            breakers[provider].record_failure(str(e))
+            raise
+        llm_stats[provider].record("successes", (time.perf_counter() - started) * 1000, first_token=True)
+        breakers[provider].record_success()
+        return token
+    
+    winner = None
+    try:
+        winner, token = await race_providers(
+            lambda name: asyncio.create_task(first_token(name)),
+            use_fallback,
+            first_token=True
+        )
+    finally:
+        # Close the losing (or failed) streams so their connections are released
+        for name, stream in streams.items():
+            if name != winner:
+                await stream.aclose()
+    return winner, token, streams[winner]
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_chat_events(request: ChatRequest, ctx: Dict[str, Any]):
+    """SSE stream for /chat/stream: start (retrieved kb_sources), sources (the ones that fit the
+    answering provider's prompt), token..., done | error"""
+    cached = ctx["cached"]
+    
+    # Sent before the LLM is called, so clients can show sources during the model's latency
+    yield sse_event("start", {
+        "kb_sources": cached["kb_sources"] if cached else ctx["kb_sources"],
+        "session_id": request.session_id,
+        "user_name": ctx["user_name"],
+        "cached": bool(cached)
+    })
+    
+    if cached:
+        yield sse_event("sources", {"provider": cached["provider"], "kb_sources": cached["kb_sources"]})
+        yield sse_event("token", {"content": cached["content"]})
+        await finish_chat(request, ctx, cached["content"], cached["provider"])
+        yield sse_event("done", {
+            "provider": cached["provider"],
+            "message": {"role": "assistant", "content": cached["content"]},
+            "kb_sources": cached["kb_sources"],
+            "cache_similarity": cached["similarity"],
+            "tokens": cached["tokens"],
+            "debug": {"cache": "hit"}
+        })
+        return
+    
+    # Same routing as /chat; the alternate only takes over before the first token
+    try:
+        provider, token, stream = await open_stream(ctx["prompts"], request.use_fallback)
+    except Exception as e:
+        yield sse_event("error", {"detail": str(e)})
+        return
+    
+    # Each provider's budget fits its own KB chunks, so the final list is known only now
+    yield sse_event("sources", {"provider": provider, "kb_sources": ctx["prompts"][provider]["kb_sources"]})
+    
+    tokens: List[str] = []
+    try:
+        if token is not None:
+            tokens.append(token)
+            yield sse_event("token", {"content": token})
+            async for token in stream:
+                tokens.append(token)
+                yield sse_event("token", {"content": token})
+    except Exception as e:
+        print(f"{provider} streaming failed: {e}")
+        llm_stats[provider].record("failures")
+        breakers[provider].record_failure(str(e))
+        yield sse_event("error", {"detail": str(e), "partial": True})
+        return
+    finally:
+        await stream.aclose()
+    
+    response_content = "".join(tokens)
+    await finish_chat(request, ctx, response_content, provider)
+    yield sse_event("done", {
+        "provider": provider,
+        "message": {"role": "assistant", "content": response_content},
+        "kb_sources": ctx["prompts"][provider]["kb_sources"],
+        "tokens": ctx["prompts"][provider]["tokens"],
+        "debug": ctx["debug"]
+    })
+
 # API Endpoints
 @app.get("/")
 async def root():
@@ -509,9 +3274,30 @@ async def root():
         "docs": "/docs"
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint - 200 only once the vector store, embedder and core KB are loaded"""
+    ready = services_ready.is_set()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "components": startup_state
+        }
+    )
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    if not services_ready.is_set():
+        # Liveness stays green while starting so the platform does not restart the container
+        return {
+            "status": "starting",
+            "ollama_url": OLLAMA_URL,
+            "kb_documents": 0,
+            "components": startup_state,
+            "llm_providers": {name: breaker.info() for name, breaker in breakers.items()}
+        }
     try:
         # Count unique documents, not chunks
         results = kb_collection.get()
@@ -525,7 +3311,15 @@ async def health_check():
         return {
             "status": "healthy",
             "ollama_url": OLLAMA_URL,
-            "kb_documents": len(unique_docs)
+            "kb_documents": len(unique_docs),
+            "core_rulebook": core_rulebook_info(),
+            "llm_providers": {name: breaker.info() for name, breaker in breakers.items()},
+            "embedding": {
+                "model": EMBEDDING_MODEL_NAME,
+                "backend": embedding_backend,
+                "requested_backend": EMBEDDING_BACKEND,
+                "parity": embedding_parity
+            }
         }
     except Exception as e:
         return {
@@ -535,81 +3329,17 @@ async def health_check():
             "error": str(e)
         }
 
-@app.post("/chat")
-async def chat(request: ChatRequest):
-    """Main chat endpoint with RAG"""
-    try:
-        # Get last user message for KB search
-        last_user_msg = next((m for m in reversed(request.messages) if m.role == "user"), None)
-        if not last_user_msg:
-            raise HTTPException(status_code=400, detail="No user message found")
-        
-        # STEP 1: Get Core docs first (Style Guide & Management Duties)
-        core_results = kb_collection.get(
-            where={"category": "Core"},
-            limit=10
-        )
-        
-        core_rulebook = ""
-        if core_results and core_results['documents']:
-            # Combine all Core doc chunks into rulebook
-            core_content = []
-            seen_titles = set()
-            for i, metadata in enumerate(core_results['metadatas']):
-                title = metadata.get('title', 'Core Document')
-                if title not in seen_titles:
-                    seen_titles.add(title)
-                    core_content.append(f"=== {title} ===")
-                core_content.append(core_results['documents'][i])
-            
-            core_rulebook = "\n".join(core_content)
-        
-        # STEP 2: Search knowledge base with boosted Core docs
-        kb_results = search_knowledge_base(last_user_msg.content, limit=5)
-        
-        # STEP 3: Apply 3x boost to Core category docs in results
-        boosted_results = []
-        for result in kb_results:
-            if result['metadata'].get('category') == 'Core':
-                # Create boosted copies (effectively tripling weight)
-                boosted_results.append(result)
-                boosted_results.append(result)
-                boosted_results.append(result)
-            else:
-                boosted_results.append(result)
-        
-        # Take top results after boosting
-        kb_results = boosted_results[:5]
-        
-        # Build context
-        kb_context = ""
-        if kb_results:
-            kb_context = "\n\nRelevant knowledge base information:\n"
-            for i, doc in enumerate(kb_results):
-                kb_context += f"\n{i+1}. {doc['metadata'].get('title', 'Untitled')}\n{doc['content']}\n"
-        
-        # Build form context
-        form_context_str = ""
-        if request.form_context:
-            form_context_str = f"\n\nCurrent form context:\n- Stage: {request.form_context.get('currentStage', 'unknown')}\n"
-            if request.form_context.get('hasABN'):
-                form_context_str += "- User has ABN\n"
-            if request.form_context.get('hasGST'):
-                form_context_str += "- User registered for GST\n"
-        
-        # Fetch user context if user_id provided - BUT DON'T USE IT FOR UNSOLICITED INFO
-        user_context_str = ""
-        user_name = None
-        if request.user_id:
-            user_ctx = fetch_user_context(request.user_id)
-            if user_ctx:
-                user_name = user_ctx['user']['name']
-                # Only store name, don't inject context that encourages overstepping
-        
-        # DYNAMIC SYSTEM PROMPT - Changes based on mode
-        if request.mode == "internal":
-            # Internal/Tax Agent Mode - Full detail, conversational, shorthand
-            system_prompt = f"""You are Luna, a warm, professional tax assistant for Australian Family Day Care educators and tax professionals.
+def build_system_prompt(
+    mode: str,
+    core_rulebook: str,
+    kb_context: str,
+    form_context_str: str,
+    user_context_str: str = ""
+) -> str:
+    """Luna's system prompt for a chat mode ('internal' or 'educator')"""
+    if mode == "internal":
+        # Internal/Tax Agent Mode - Full detail, conversational, shorthand
+        system_prompt = f"""You are Luna, a warm, professional tax assistant for Australian Family Day Care educators and tax professionals.
 
 ═══════════════════════════════════════════════════════
 🔒 CRITICAL CORE RULEBOOK — HIGHEST PRIORITY 🔒
@@ -647,9 +3377,9 @@ Your role:
 
 IMPORTANT: Use the knowledge base information below - it contains official FDC guidance and technical details.
 {kb_context}{form_context_str}{user_context_str}"""
-        else:
-            # Educator/Client Mode - STRICT: Only answer what's asked
-            system_prompt = f"""You are Luna, a professional tax assistant for FDC educators.
+    else:
+        # Educator/Client Mode - STRICT: Only answer what's asked
+        system_prompt = f"""You are Luna, a professional tax assistant for FDC educators.
 
 ══════════════════════════════════════════════════════════════════
 ⛔ CRITICAL INSTRUCTION — READ THIS FIRST ⛔
@@ -697,93 +3427,315 @@ WRONG (too much unsolicited info):
 KNOWLEDGE BASE:
 ══════════════════════════════════════════════════════════════════
 {kb_context}{form_context_str}"""
+    return system_prompt
+
+# Per-provider tokenizers (tiktoken encodings closest to gpt-4o and llama3's 128k vocabulary)
+TOKEN_ENCODINGS = {"openai": "o200k_base", "ollama": "cl100k_base"}
+token_encoders: Dict[str, Any] = {}
+
+def token_encoder(provider: str):
+    """tiktoken encoding for a provider, or None to fall back to estimate_tokens"""
+    if provider not in token_encoders:
+        try:
+            import tiktoken
+            token_encoders[provider] = tiktoken.get_encoding(TOKEN_ENCODINGS[provider])
+        except Exception as e:
+            print(f"⚠️ tiktoken unavailable for {provider} ({e}), estimating prompt tokens")
+            token_encoders[provider] = None
+    return token_encoders[provider]
+
+@lru_cache(maxsize=1024)
+def count_tokens(text: str, provider: str) -> int:
+    """Prompt tokens of text for a provider (cached: rulebook and chunks repeat across chats)"""
+    encoder = token_encoder(provider)
+    if encoder is None:
+        return estimate_tokens(text)
+    return len(encoder.encode(text, disallowed_special=()))
+
+def message_tokens(message: Dict[str, str], provider: str) -> int:
+    """Tokens of one chat message, including the per-message role framing"""
+    return count_tokens(message["content"], provider) + 4
+
+def prompt_budget(provider: str) -> int:
+    return OLLAMA_NUM_CTX - PROMPT_REPLY_RESERVE if provider == "ollama" else OPENAI_PROMPT_BUDGET
+
+def summarize_trimmed(messages: List[Dict[str, str]], budget: int, provider: str) -> str:
+    """Extractive note of trimmed turns: their questions, newest kept first when space runs out"""
+    header = "\n\nEarlier in this conversation (trimmed to fit), the user asked:"
+    used = count_tokens(header, provider)
+    lines: List[str] = []
+    for message in reversed(messages):
+        if message["role"] != "user":
+            continue
+        question = " ".join(message["content"].split())
+        line = f"\n- {question[:200]}{'...' if len(question) > 200 else ''}"
+        cost = count_tokens(line, provider)
+        if used + cost > budget:
+            break
+        lines.insert(0, line)
+        used += cost
+    return header + "".join(lines) if lines else ""
+
+def kb_sources(kb_results: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Title and category of each KB result, as cited to clients"""
+    return [{
+        "title": doc['metadata'].get('title', 'Untitled'),
+        "category": doc['metadata'].get('category', 'Unknown')
+    } for doc in kb_results]
+
+def fit_prompt(
+    provider: str,
+    mode: str,
+    core_rulebook: str,
+    kb_results: List[Dict[str, Any]],
+    form_context_str: str,
+    user_context_str: str,
+    messages: List[Dict[str, str]]
+) -> Dict[str, Any]:
+    """Fit system prompt, KB context and history into one provider's prompt budget
+    
+    Returns {"system_prompt", "messages", "kb_sources", "tokens"}: kb_sources cites only the chunks
+    that fit, and tokens is the breakdown reported to clients.
+    """
+    budget = prompt_budget(provider)
+    static_tokens = count_tokens(
+        build_system_prompt(mode, core_rulebook, "", form_context_str, user_context_str), provider
+    )
+    latest, earlier = messages[-1:], messages[:-1]
+    latest_tokens = sum(message_tokens(m, provider) for m in latest)
+    remaining = budget - static_tokens - latest_tokens
+    
+    # Top-ranked KB chunks, in rank order, while they fit
+    kb_context = ""
+    kb_tokens = 0
+    kb_used = 0
+    for i, doc in enumerate(kb_results):
+        header = "" if kb_used else "\n\nRelevant knowledge base information:\n"
+        entry = f"{header}\n{i+1}. {doc['metadata'].get('title', 'Untitled')}\n{doc['content']}\n"
+        cost = count_tokens(entry, provider)
+        if cost > remaining - kb_tokens:
+            break
+        kb_context += entry
+        kb_tokens += cost
+        kb_used += 1
+    remaining -= kb_tokens
+    
+    # Earlier turns newest-first; if they do not all fit, keep room for a note of the trimmed questions
+    earlier_tokens = [message_tokens(m, provider) for m in earlier]
+    history_budget = remaining if sum(earlier_tokens) <= remaining else remaining - HISTORY_SUMMARY_TOKENS
+    kept = 0
+    history_tokens = 0
+    for cost in reversed(earlier_tokens):
+        if history_tokens + cost > history_budget:
+            break
+        history_tokens += cost
+        kept += 1
+    # Never open the kept history on an assistant reply whose question was trimmed
+    if kept < len(earlier) and kept and earlier[len(earlier) - kept]["role"] == "assistant":
+        history_tokens -= earlier_tokens[len(earlier) - kept]
+        kept -= 1
+    trimmed = earlier[:len(earlier) - kept]
+    summary = summarize_trimmed(trimmed, min(HISTORY_SUMMARY_TOKENS, remaining - history_tokens), provider) if trimmed else ""
+    summary_tokens = count_tokens(summary, provider) if summary else 0
+    
+    if trimmed or kb_used < len(kb_results):
+        print(
+            f"✂️ {provider} prompt budget {budget}: {kb_used}/{len(kb_results)} KB chunks, "
+            f"{len(trimmed)} earlier messages trimmed"
+        )
+    
+    total = static_tokens + kb_tokens + summary_tokens + history_tokens + latest_tokens
+    return {
+        "system_prompt": build_system_prompt(mode, core_rulebook, kb_context, form_context_str, user_context_str) + summary,
+        "messages": earlier[len(trimmed):] + latest,
+        "kb_sources": kb_sources(kb_results[:kb_used]),
+        "tokens": {
+            "budget": budget,
+            "total": total,
+            "system": static_tokens,
+            "rulebook": count_tokens(core_rulebook, provider),
+            "kb_context": kb_tokens,
+            "kb_chunks": kb_used,
+            "kb_chunks_dropped": len(kb_results) - kb_used,
+            "history": history_tokens + latest_tokens,
+            "history_messages": kept + len(latest),
+            "history_trimmed": len(trimmed),
+            "history_summary": summary_tokens,
+            "over_budget": total > budget,
+            "tokenizer": TOKEN_ENCODINGS[provider] if token_encoder(provider) else "estimate"
+        }
+    }
+
+async def prepare_chat(request: ChatRequest) -> Dict[str, Any]:
+    """Everything /chat does before calling the LLM: user lookup, answer cache, KB search, prompt
+    
+    Returns a context dict; if "cached" is set the answer cache already holds the reply.
+    """
+    # Get last user message for KB search
+    last_user_msg = next((m for m in reversed(request.messages) if m.role == "user"), None)
+    if not last_user_msg:
+        raise HTTPException(status_code=400, detail="No user message found")
+    
+    # Build form context
+    form_context_str = ""
+    if request.form_context:
+        form_context_str = f"\n\nCurrent form context:\n- Stage: {request.form_context.get('currentStage', 'unknown')}\n"
+        if request.form_context.get('hasABN'):
+            form_context_str += "- User has ABN\n"
+        if request.form_context.get('hasGST'):
+            form_context_str += "- User registered for GST\n"
+    
+    # Fetch user context if user_id provided - BUT DON'T USE IT FOR UNSOLICITED INFO
+    user_context_str = ""
+    user_name = None
+    if request.user_id:
+        user_ctx = await fetch_user_context(request.user_id)
+        if user_ctx:
+            user_name = user_ctx['user']['name']
+            # Only store name, don't inject context that encourages overstepping
+    
+    ctx: Dict[str, Any] = {"query": last_user_msg.content, "user_name": user_name, "cached": None}
+    
+    # STEP 0: Serve near-identical standalone questions from the semantic answer cache
+    # (follow-ups are not cached - their answers depend on the conversation so far)
+    sync_kb_changes()
+    ctx["cacheable"] = ANSWER_CACHE_ENABLED and not any(m.role == "assistant" for m in request.messages)
+    try:
+        kb_where = build_where(filters={**CHAT_MODE_FILTERS.get(request.mode, {}), **(request.filters or {})})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    ctx["cache_context_key"] = content_hash(
+        f"{request.search_mode or SEARCH_MODE}|{request.diversify}|{request.rerank}|{request.use_fallback}|"
+        f"{json.dumps(kb_where, sort_keys=True)}\n{form_context_str}"
+    )
+    ctx["cache_kb_version"] = answer_cache.kb_version
+    ctx["query_vector"] = await run_in_threadpool(embed_query, last_user_msg.content) if ctx["cacheable"] else None
+    if ctx["cacheable"]:
+        ctx["cached"] = answer_cache.lookup(ctx["query_vector"], request.mode, ctx["cache_context_key"])
+        if ctx["cached"]:
+            return ctx
+    
+    # STEP 1: Core rulebook (Style Guide & Management Duties) - cached until Core docs change
+    core_rulebook = await run_in_threadpool(get_core_rulebook)
+    
+    # STEP 2: Search knowledge base (Core docs weighted up by the scoring stage)
+    ctx["debug"] = {}
+    kb_results = await run_in_threadpool(
+        search_knowledge_base,
+        last_user_msg.content, limit=CHAT_KB_LIMIT, search_mode=request.search_mode,
+        diversify=request.diversify, where=kb_where, rerank=request.rerank, debug=ctx["debug"]
+    )
+    
+    ctx["kb_sources"] = kb_sources(kb_results)
+    
+    # DYNAMIC SYSTEM PROMPT - Changes based on mode, fitted to each provider's token budget
+    messages = [{"role": m.role, "content": m.content} for m in request.messages]
+    ctx["prompts"] = {
+        provider: fit_prompt(
+            provider, request.mode, core_rulebook, kb_results, form_context_str, user_context_str, messages
+        )
+        for provider in LLM_CALLS
+    }
+    return ctx
+
+async def finish_chat(request: ChatRequest, ctx: Dict[str, Any], response_content: str, provider: str):
+    """Save the conversation and store a fresh answer in the answer cache"""
+    # Save conversation if user_id provided
+    if request.user_id:
+        await save_conversation(
+            user_id=request.user_id,
+            query=ctx["query"],
+            response=response_content,
+            mode=request.mode
+        )
+    
+    if ctx["cacheable"] and not ctx["cached"]:
+        answer_cache.store(
+            ctx["query_vector"], request.mode, ctx["cache_context_key"], ctx["cache_kb_version"],
+            {
+                "content": response_content,
+                "kb_sources": ctx["prompts"][provider]["kb_sources"],
+                "provider": provider,
+                "tokens": ctx["prompts"][provider]["tokens"]
+            }
+        )
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    """Main chat endpoint with RAG"""
+    try:
+        ctx = await prepare_chat(request)
         
-        # Format messages for LLM
-        formatted_messages = [{"role": m.role, "content": m.content} for m in request.messages]
+        cached = ctx["cached"]
+        if cached:
+            await finish_chat(request, ctx, cached["content"], cached["provider"])
+            return {
+                "message": {
+                    "role": "assistant",
+                    "content": cached["content"]
+                },
+                "kb_sources": cached["kb_sources"],
+                "session_id": request.session_id,
+                "provider": cached["provider"],
+                "user_name": ctx["user_name"],
+                "cached": True,
+                "cache_similarity": cached["similarity"],
+                "tokens": cached["tokens"],
+                "debug": {"cache": "hit"}
+            }
         
-        # Use OpenAI as primary (faster, more reliable), Ollama as optional
+        # Use OpenAI as primary (faster, more reliable), Ollama as optional;
+        # the alternate takes over on failure, or races a slow primary when hedging
         try:
-            if request.use_fallback:
-                # Use Ollama if explicitly requested
-                print("Using Ollama (user preference)...")
-                response_content = call_ollama(formatted_messages, system_prompt)
-                provider = "ollama"
-            else:
-                # Default to OpenAI (primary)
-                print("Using OpenAI GPT-4 (primary)...")
-                response_content = call_openai_fallback(formatted_messages, system_prompt)
-                provider = "openai"
+            response_content, provider = await generate_reply(ctx["prompts"], request.use_fallback)
         except Exception as e:
-            # If primary fails, try the other option
-            print(f"Primary LLM failed ({e}), trying alternate...")
-            try:
-                if request.use_fallback:
-                    # Ollama failed, try OpenAI
-                    response_content = call_openai_fallback(formatted_messages, system_prompt)
-                    provider = "openai"
-                else:
-                    # OpenAI failed, try Ollama
-                    response_content = call_ollama(formatted_messages, system_prompt)
-                    provider = "ollama"
-            except Exception as e2:
-                raise HTTPException(status_code=500, detail=f"Both LLMs failed. OpenAI: {e}, Ollama: {e2}")
-        
-        # Save conversation if user_id provided
-        if request.user_id and last_user_msg:
-            save_conversation(
-                user_id=request.user_id,
-                query=last_user_msg.content,
-                response=response_content,
-                mode=request.mode
-            )
+            raise HTTPException(status_code=500, detail=str(e))
+        
+        await finish_chat(request, ctx, response_content, provider)
         
         return {
             "message": {
                 "role": "assistant",
                 "content": response_content
             },
-            "kb_sources": [{
-                "title": doc['metadata'].get('title', 'Untitled'),
-                "category": doc['metadata'].get('category', 'Unknown')
-            } for doc in kb_results],
+            "kb_sources": ctx["prompts"][provider]["kb_sources"],
             "session_id": request.session_id,
             "provider": provider,
-            "user_name": user_name  # Include user name for frontend personalization
+            "user_name": ctx["user_name"],  # Include user name for frontend personalization
+            "cached": False,
+            "tokens": ctx["prompts"][provider]["tokens"],
+            "debug": ctx["debug"]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Streaming /chat: relays LLM tokens as server-sent events"""
+    try:
+        ctx = await prepare_chat(request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return StreamingResponse(
+        stream_chat_events(request, ctx),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/ingest/document")
 async def ingest_document(doc: DocumentIngest):
     """Ingest a text document into the knowledge base"""
     try:
-        # Chunk the content
-        chunks = chunk_text(doc.content)
-        
-        # Generate embeddings and store
-        doc_id = str(uuid.uuid4())
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"{doc_id}_chunk_{i}"
-            embedding = embedding_model.encode([chunk])[0].tolist()
-            
-            kb_collection.add(
-                ids=[chunk_id],
-                embeddings=[embedding],
-                documents=[chunk],
-                metadatas=[{
-                    "title": doc.title,
-                    "category": doc.category,
-                    "chunk_index": i,
-                    "doc_id": doc_id,
-                    **(doc.metadata or {})
-                }]
-            )
-        
-        return {
-            "status": "success",
-            "doc_id": doc_id,
-            "chunks_created": len(chunks)
-        }
+        return await run_in_threadpool(
+            ingest_text, doc.title, doc.content, doc.category, doc.metadata, source_key=doc.source_key
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -791,47 +3743,128 @@ async def ingest_document(doc: DocumentIngest):
 async def ingest_file(
     file: UploadFile = File(...), 
     category: str = Form("General"), 
-    title: Optional[str] = Form(None)
+    title: Optional[str] = Form(None),
+    background: bool = Form(False),
+    source_key: Optional[str] = Form(None)
 ):
-    """Ingest a PDF, DOCX, RTF, or TXT file"""
+    """Ingest a PDF, DOCX, RTF, or TXT file
+    
+    With background=true the upload returns a job id immediately and the work runs
+    on the ingestion worker pool (poll /ingest/jobs/{job_id} for progress).
+    With a source_key, re-uploading a revised file updates the existing document incrementally.
+    """
     try:
         file_bytes = await file.read()
         
-        # Extract text based on file type
-        if file.filename.endswith('.pdf'):
-            content = extract_text_from_pdf(file_bytes)
-        elif file.filename.endswith('.docx'):
-            content = extract_text_from_docx(file_bytes)
-        elif file.filename.endswith('.rtf'):
-            content = extract_text_from_rtf(file_bytes)
-        elif file.filename.endswith('.txt'):
-            content = extract_text_from_txt(file_bytes)
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type. Use PDF, DOCX, RTF, or TXT.")
-        
-        # Use provided title, fallback to filename
-        doc_title = title if title else file.filename
+        if background:
+            if not file.filename.endswith(('.pdf', '.docx', '.rtf', '.txt')):
+                raise HTTPException(status_code=400, detail="Unsupported file type. Use PDF, DOCX, RTF, or TXT.")
+            job = submit_ingest_job(file.filename, file_bytes, category, title, source_key)
+            return {
+                "status": "queued",
+                "job_id": job["job_id"],
+                "status_url": f"/ingest/jobs/{job['job_id']}"
+            }
         
-        # Ingest the document
-        doc = DocumentIngest(
-            title=doc_title,
-            content=content,
-            category=category,
-            metadata={"filename": file.filename}
-        )
+        def ingest_upload():
+            # Extract text based on file type
+            timings = {}
+            stage_start = time.perf_counter()
+            content = extract_segments(file.filename, file_bytes)
+            timings["extract"] = round((time.perf_counter() - stage_start) * 1000, 2)
+            
+            # Use provided title, fallback to filename
+            doc_title = title if title else file.filename
+            
+            # Ingest the document
+            return ingest_text(
+                title=doc_title,
+                content=content,
+                category=category,
+                metadata={"filename": file.filename},
+                timings=timings,
+                source_key=source_key
+            )
         
-        return await ingest_document(doc)
+        return await run_in_threadpool(ingest_upload)
+    except HTTPException as e:
+        # Client errors (unsupported file type, 429 queue full) keep their status so clients can act on them
+        if e.status_code < 500:
+            raise
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/ingest/jobs")
+async def list_ingest_jobs():
+    """List background ingestion jobs (most recent first)"""
+    with ingest_jobs_lock:
+        jobs = [dict(job) for job in ingest_jobs.values()]
+    jobs.sort(key=lambda j: j["created_at"], reverse=True)
+    
+    counts = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    
+    return {
+        "jobs": jobs,
+        "total": len(jobs),
+        "status_counts": counts,
+        "workers": INGEST_WORKERS
+    }
+
+@app.get("/ingest/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """Get status and progress of a background ingestion job"""
+    with ingest_jobs_lock:
+        job = ingest_jobs.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return dict(job)
+
 @app.post("/kb/search")
 async def search_kb(request: KBSearchRequest):
     """Search knowledge base"""
-    results = search_knowledge_base(request.query, request.limit)
+    try:
+        where = build_where(request.category, request.doc_id, request.source, request.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    debug: Dict[str, Any] = {}
+    results = await run_in_threadpool(
+        search_knowledge_base, request.query, request.limit, request.search_mode,
+        request.diversify, where, request.rerank, debug
+    )
     return {
         "query": request.query,
         "results": results,
-        "count": len(results)
+        "count": len(results),
+        "debug": debug
+    }
+
+@app.post("/kb/search/batch")
+async def search_kb_batch(request: KBBatchSearchRequest):
+    """Search knowledge base for many queries in one call"""
+    if len(request.queries) > KB_SEARCH_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {KB_SEARCH_BATCH_MAX} queries per batch")
+    try:
+        where = build_where(request.category, request.doc_id, request.source, request.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    debug: Dict[str, Any] = {}
+    try:
+        batches = await run_in_threadpool(
+            search_knowledge_base_batch, request.queries, request.limit, request.search_mode,
+            request.diversify, where, request.rerank, debug
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "results": [
+            {"query": query, "results": results, "count": len(results)}
+            for query, results in zip(request.queries, batches)
+        ],
+        "count": len(batches),
+        "debug": debug
     }
 
 @app.get("/kb/stats")
@@ -841,11 +3874,48 @@ async def kb_stats():
         count = kb_collection.count()
         return {
             "total_documents": count,
-            "collection_name": "fdc_knowledge_base"
+            "collection_name": "fdc_knowledge_base",
+            "lexical_index": lexical_index.stats(),
+            "search_engine": "exact" if exact_index is not None else "chroma",
+            "exact_index": exact_index.stats() if exact_index is not None else None
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/kb/rulebook/refresh")
+async def refresh_core_rulebook():
+    """Rebuild the cached Core rulebook (e.g. after update_core_docs.py recategorized documents)"""
+    try:
+        notify_kb_changed(core_changed=True)
+        get_core_rulebook()
+        return {"status": "success", "core_rulebook": core_rulebook_info()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/llm/stats")
+async def get_llm_stats():
+    """Per-provider LLM latency, outcome and hedging statistics"""
+    return {
+        "hedging": LLM_HEDGING,
+        "hedge_delay_ms": {
+            provider: {
+                "completion": round(hedge_delay(provider) * 1000, 1),
+                "first_token": round(hedge_delay(provider, first_token=True) * 1000, 1)
+            }
+            for provider in llm_stats
+        },
+        "providers": {provider: stats.stats() for provider, stats in llm_stats.items()}
+    }
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Get embedding, query and answer cache hit/miss statistics"""
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "query_cache": query_cache.stats(),
+        "answer_cache": answer_cache.stats()
+    }
+
 @app.get("/kb/documents")
 async def list_documents():
     """List all ingested documents with metadata"""
@@ -928,6 +3998,10 @@ async def delete_document(doc_id: str):
         
         # Delete all chunks
         kb_collection.delete(ids=results['ids'])
+        unindex_chunks(results['ids'])
+        notify_kb_changed(
+            core_changed=any(m.get('category') == "Core" for m in (results['metadatas'] or []))
+        )
         
         return {
             "status": "success",
@@ -972,12 +4046,14 @@ async def clear_kb():
             name="fdc_knowledge_base",
             metadata={"hnsw:space": "cosine"}
         )
+        clear_search_indexes()
+        notify_kb_changed(core_changed=True)
         return {"status": "success", "message": "Knowledge base cleared"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 def prewarm_ollama():
-    """Pre-warm Ollama on startup to avoid cold-start delays"""
+    """Pre-warm Ollama on startup to avoid cold-start delays (returns True when warm)"""
     print("🔥 Pre-warming Ollama (llama3:8b)...")
     try:
         response = requests.post(
@@ -988,24 +4064,24 @@ def prewarm_ollama():
                     {"role": "system", "content": "You are a helpful assistant."},
                     {"role": "user", "content": "Say 'ready'"}
                 ],
-                "stream": False
+                "stream": False,
+                "options": {"num_ctx": OLLAMA_NUM_CTX}  # same window as chats, so the model is not reloaded
             },
             timeout=180
         )
         if response.status_code == 200:
             print("✅ Ollama pre-warmed and ready!")
-        else:
-            print(f"⚠️ Ollama pre-warm failed: {response.status_code}")
+            return True
+        print(f"⚠️ Ollama pre-warm failed: {response.status_code}")
+        return False
     except Exception as e:
         print(f"⚠️ Ollama pre-warm error (will use OpenAI fallback): {e}")
+        return False
 
 if __name__ == "__main__":
     import uvicorn
-    import threading
-    
-    # Pre-warm Ollama in background thread
-    threading.Thread(target=prewarm_ollama, daemon=True).start()
     
+    # Start-up (including the Ollama pre-warm) runs in the background - see start_background_initialization
     # Use PORT env var for production (DO App Platform), default to 8002 for local
     port = int(os.getenv("PORT", 8002))
     uvicorn.run(app, host="0.0.0.0", port=port)
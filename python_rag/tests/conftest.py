@@ -0,0 +1,43 @@
+"""Shared fixtures: main wired to an in-memory ChromaDB collection and a stand-in embedder"""
+
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+os.environ.setdefault("CHROMA_DB_PATH", tempfile.mkdtemp(prefix="chroma-test-"))
+os.environ["EMBEDDING_CACHE_PATH"] = ""
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import chromadb
+import numpy as np
+import pytest
+
+import main
+
+
+class HashEmbedder:
+    """Deterministic stand-in for the sentence-transformers model"""
+    
+    def encode(self, texts, batch_size=32, **kwargs):
+        return np.stack([
+            np.random.default_rng(int(main.content_hash(text)[:8], 16)).standard_normal(16).astype(np.float32)
+            for text in texts
+        ])
+
+
+@pytest.fixture
+def kb(monkeypatch):
+    collection = chromadb.EphemeralClient().create_collection(
+        f"test-{uuid.uuid4().hex[:12]}", metadata={"hnsw:space": "cosine"}
+    )
+    exact = main.ExactSearchIndex(tempfile.gettempdir())
+    monkeypatch.setattr(main, "kb_collection", collection)
+    monkeypatch.setattr(main, "exact_index", exact)
+    monkeypatch.setattr(main, "lexical_index", main.LexicalIndex())
+    monkeypatch.setattr(main, "embedding_model", HashEmbedder())
+    monkeypatch.setattr(main, "embedding_cache", main.EmbeddingCache("test", 100))
+    yield collection
+    main.exact_index.close()
@@ -0,0 +1,58 @@
+"""Semantic answer cache: hit responses and invalidation on KB changes"""
+
+import asyncio
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def chat_kb(kb, monkeypatch):
+    monkeypatch.setattr(main, "ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr(main, "answer_cache", main.SemanticAnswerCache(10, 0.02))
+    monkeypatch.setattr(main, "query_cache", main.TTLCache(10))
+    monkeypatch.setattr(main, "schedule_index_rebuild", lambda: None)
+    monkeypatch.setattr(main, "kb_marker_seen", None)
+    calls = []
+    
+    async def fake_reply(prompts, use_fallback):
+        calls.append(prompts)
+        return "Yes, at your FDC percentage.", "openai"
+    
+    monkeypatch.setattr(main, "generate_reply", fake_reply)
+    main.ingest_text("Electricity", "Educators claim electricity at the FDC percentage.", "Tax")
+    return calls
+
+
+def ask(question):
+    request = main.ChatRequest(messages=[main.ChatMessage(role="user", content=question)], session_id="s1")
+    return asyncio.run(main.chat(request))
+
+
+def test_cache_hit_has_the_same_shape_as_a_fresh_answer(chat_kb):
+    fresh = ask("Can I claim electricity?")
+    cached = ask("can i claim electricity")
+    
+    assert len(chat_kb) == 1
+    assert fresh["cached"] is False and cached["cached"] is True
+    assert set(fresh) <= set(cached)
+    assert cached["tokens"] == fresh["tokens"]
+    assert cached["debug"] == {"cache": "hit"}
+    assert cached["message"] == fresh["message"]
+
+
+def test_ingest_invalidates_cached_answers(chat_kb):
+    ask("Can I claim electricity?")
+    main.ingest_text("Gas", "Gas is claimed at the FDC percentage too.", "Tax")
+    assert ask("Can I claim electricity?")["cached"] is False
+    assert len(chat_kb) == 2
+
+
+def test_kb_change_marker_invalidates_cached_answers(chat_kb):
+    ask("Can I claim electricity?")
+    time.sleep(0.01)
+    main.KB_CHANGE_MARKER.touch()  # another process wrote to the KB
+    assert ask("Can I claim electricity?")["cached"] is False
+    assert len(chat_kb) == 2
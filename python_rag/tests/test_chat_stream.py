@@ -0,0 +1,72 @@
+"""/chat/stream event order against a fake streaming provider"""
+
+import asyncio
+import json
+
+import pytest
+
+import main
+
+
+def parse(event):
+    name, data = event.strip().split("\n")
+    return name[len("event: "):], json.loads(data[len("data: "):])
+
+
+@pytest.fixture
+def provider(kb, monkeypatch):
+    monkeypatch.setattr(main, "schedule_index_rebuild", lambda: None)
+    main.ingest_text("Electricity", "Educators claim electricity at the FDC percentage.", "Tax")
+    calls = []
+    
+    async def fake_stream(messages, system_prompt):
+        calls.append(system_prompt)
+        for token in ("Yes, ", "at your ", "FDC percentage."):
+            await asyncio.sleep(0)
+            yield token
+    
+    async def failing_stream(messages, system_prompt):
+        raise RuntimeError("offline")
+        yield  # pragma: no cover - makes this an async generator
+    
+    monkeypatch.setitem(main.LLM_STREAMS, "openai", fake_stream)
+    monkeypatch.setitem(main.LLM_STREAMS, "ollama", failing_stream)
+    monkeypatch.setattr(main, "breakers", {name: main.CircuitBreaker(name) for name in main.LLM_STREAMS})
+    return calls
+
+
+def stream(question, on_event=None):
+    async def collect():
+        request = main.ChatRequest(messages=[main.ChatMessage(role="user", content=question)], session_id="s1")
+        ctx = await main.prepare_chat(request)
+        events = []
+        async for event in main.stream_chat_events(request, ctx):
+            events.append(parse(event))
+            if on_event:
+                on_event(events[-1])
+        return events
+    return asyncio.run(collect())
+
+
+def test_start_is_sent_before_the_provider_is_called(provider):
+    calls_at_start = []
+    events = stream(
+        "Can I claim electricity?",
+        lambda event: calls_at_start.append(len(provider)) if event[0] == "start" else None
+    )
+    
+    assert calls_at_start == [0]
+    assert [name for name, _ in events] == ["start", "sources", "token", "token", "token", "done"]
+    start, sources, done = events[0][1], events[1][1], events[-1][1]
+    assert start["kb_sources"] == [{"title": "Electricity", "category": "Tax"}]
+    assert sources == {"provider": "openai", "kb_sources": start["kb_sources"]}
+    assert done["message"]["content"] == "Yes, at your FDC percentage."
+    assert done["kb_sources"] == sources["kb_sources"]
+    assert done["tokens"]["kb_chunks"] == 1
+
+
+def test_failed_providers_end_the_stream_with_an_error(provider, monkeypatch):
+    monkeypatch.setitem(main.LLM_STREAMS, "openai", main.LLM_STREAMS["ollama"])
+    events = stream("Can I claim electricity?")
+    assert [name for name, _ in events] == ["start", "error"]
+    assert "Both LLMs failed" in events[1][1]["detail"]
@@ -0,0 +1,73 @@
+"""Structure-aware chunker and the legacy fixed-size chunker"""
+
+import pytest
+
+import main
+
+DOCUMENT = (
+    "Short intro paragraph.\n\n"
+    "First line of a long paragraph here\n"
+    "Second line of it. It has two sentences that run on a bit.\n\n"
+    "Tail."
+)
+
+
+def test_offsets_point_at_chunk_text_in_joined_segments():
+    pages = [
+        "GST registration is required at $75,000 turnover.\n\nBAS is usually lodged quarterly.",
+        "Keep receipts for five years.\n\nA logbook covers 12 continuous weeks.",
+        "GST registration is required at $75,000 turnover.\n\nBAS is usually lodged quarterly.",
+    ]
+    joined = "\n\n".join(pages)
+    for max_tokens in (8, 15, 40, 200):
+        chunks = main.chunk_structured(pages, max_tokens=max_tokens, min_tokens=0)
+        assert chunks
+        for chunk in chunks:
+            assert joined[chunk["start_offset"]:chunk["end_offset"]] == chunk["text"]
+
+
+def test_repeated_segment_keeps_both_copies():
+    page = "Alpha paragraph one.\n\nBeta paragraph two."
+    chunks = main.chunk_document([page, page], chunker="structured")
+    assert "".join(chunk["text"] for chunk in chunks).count("Alpha paragraph one.") == 2
+
+
+def test_splits_paragraphs_then_lines_then_sentences_then_words():
+    units = [DOCUMENT[start:end] for start, end in main.structural_units(DOCUMENT, 8)]
+    assert units == [
+        "Short intro paragraph.",            # paragraph fits whole
+        "First line of a long paragraph",   # line too long, no sentence break: packed words
+        "here",
+        "Second line of it.",               # line too long: split into sentences
+        "It has two sentences that run on",  # sentence too long: packed words
+        "a bit.",
+        "Tail.",
+    ]
+    assert all(main.estimate_tokens(unit) <= 8 for unit in units)
+    assert [DOCUMENT[start:end] for start, end in main.structural_units(DOCUMENT, 200)] == DOCUMENT.split("\n\n")
+
+
+def test_tiny_tail_is_folded_into_previous_chunk():
+    paragraphs = ["a" * 35 + ".", "b" * 35 + ".", "End."]
+    
+    separate = main.chunk_structured(paragraphs, max_tokens=10, min_tokens=0)
+    assert [chunk["text"] for chunk in separate] == paragraphs
+    
+    folded = main.chunk_structured(paragraphs, max_tokens=10, min_tokens=4)
+    assert [chunk["text"] for chunk in folded] == [paragraphs[0], paragraphs[1] + "\n\nEnd."]
+    assert folded[-1]["end_offset"] == len("\n\n".join(paragraphs))
+
+
+def test_fixed_chunker_keeps_legacy_slices(monkeypatch):
+    text = "".join(chr(ord("a") + i % 26) for i in range(1200))
+    monkeypatch.setattr(main, "CHUNKER", "fixed")
+    chunks = main.chunk_document(text)
+    spans = [(0, 500), (450, 950), (900, 1200)]
+    assert [(chunk["start_offset"], chunk["end_offset"]) for chunk in chunks] == spans
+    assert [chunk["text"] for chunk in chunks] == [text[start:end] for start, end in spans]
+    assert main.chunk_text(text) == [text[start:end] for start, end in spans]
+
+
+def test_unknown_chunker_is_rejected():
+    with pytest.raises(ValueError):
+        main.chunk_document("text", chunker="semantic")
@@ -0,0 +1,147 @@
+"""Circuit breaker state machine, background probes and breaker-aware provider routing"""
+
+import asyncio
+
+import pytest
+
+import main
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(main.time, "monotonic", clock)
+    monkeypatch.setattr(main, "BREAKER_ENABLED", True)
+    monkeypatch.setattr(main, "BREAKER_FAILURE_THRESHOLD", 3)
+    monkeypatch.setattr(main, "BREAKER_WINDOW", 10)
+    monkeypatch.setattr(main, "BREAKER_ERROR_RATE", 0.5)
+    monkeypatch.setattr(main, "BREAKER_SLOW_CALL_MS", 5000)
+    monkeypatch.setattr(main, "BREAKER_OPEN_SECONDS", 30)
+    return clock
+
+
+@pytest.fixture
+def breakers(clock, monkeypatch):
+    breakers = {name: main.CircuitBreaker(name) for name in ("openai", "ollama")}
+    monkeypatch.setattr(main, "breakers", breakers)
+    return breakers
+
+
+def test_consecutive_failures_open_the_breaker(clock):
+    breaker = main.CircuitBreaker("openai")
+    breaker.record_failure("boom")
+    breaker.record_failure("boom")
+    breaker.record_success(100)
+    breaker.record_failure("boom")
+    breaker.record_failure("boom")
+    assert breaker.state == "closed"  # the success reset the streak
+    
+    breaker.record_failure("boom")
+    assert breaker.state == "open" and breaker.allows() is False
+    assert breaker.opened_at == clock.now
+    assert breaker.counts["opened"] == 1
+
+
+def test_error_rate_opens_the_breaker_once_the_window_is_full(clock):
+    breaker = main.CircuitBreaker("openai")
+    for _ in range(4):
+        breaker.record_failure("boom")  # never three in a row
+        breaker.record_success(100)
+    breaker.record_failure("boom")
+    assert breaker.state == "closed"  # 5/9 failing, but the window is not full yet
+    
+    breaker.record_success(100)
+    breaker.record_failure("boom")
+    assert len(breaker.outcomes) == 10 and breaker.error_rate() == 0.5
+    assert breaker.state == "open"
+
+
+def test_slow_calls_count_as_failures(clock):
+    breaker = main.CircuitBreaker("openai")
+    breaker.record_success(4000)
+    assert breaker.consecutive_failures == 0
+    
+    for _ in range(3):
+        breaker.record_success(6000)
+    assert breaker.state == "open"
+    assert breaker.last_error == "slow call (6.0s)"
+
+
+def test_probe_is_due_after_the_open_period(clock):
+    breaker = main.CircuitBreaker("openai")
+    breaker.last_error = "boom"
+    breaker.open()
+    clock.now += 29.9
+    assert breaker.due_probe() is False
+    assert breaker.info()["retry_in_s"] == 0.1
+    clock.now += 0.1
+    assert breaker.due_probe() is True
+
+
+def test_probe_closes_or_reopens_due_breakers(breakers, clock, monkeypatch):
+    probed = []
+    
+    async def probe(provider):
+        probed.append(provider)
+        if provider == "ollama":
+            raise RuntimeError("still down")
+    
+    monkeypatch.setattr(main, "probe_provider", probe)
+    for breaker in breakers.values():
+        breaker.open()
+    
+    clock.now += 10
+    asyncio.run(main.probe_due_breakers())
+    assert probed == []  # neither open period has elapsed
+    
+    clock.now += 20
+    asyncio.run(main.probe_due_breakers())
+    assert probed == ["openai", "ollama"]
+    assert breakers["openai"].state == "closed" and breakers["openai"].outcomes == main.deque()
+    assert breakers["ollama"].state == "open" and breakers["ollama"].opened_at == clock.now
+    assert breakers["ollama"].last_error == "probe: still down"
+    assert breakers["ollama"].counts == {"opened": 1, "probes": 1, "probe_failures": 1}
+
+
+def race(use_fallback=False, failing=()):
+    started = []
+    
+    async def answer(provider):
+        if provider in failing:
+            raise RuntimeError(f"{provider} down")
+        return provider
+    
+    def start(provider):
+        started.append(provider)
+        return asyncio.create_task(answer(provider))
+    
+    async def run():
+        return await main.race_providers(start, use_fallback)
+    
+    return asyncio.run(run()), started
+
+
+def test_open_primary_routes_to_the_alternate(breakers):
+    breakers["openai"].open()
+    assert race() == (("ollama", "ollama"), ["ollama"])
+
+
+def test_open_alternate_is_not_used_as_fallback(breakers):
+    breakers["ollama"].open()
+    with pytest.raises(Exception, match="ollama: circuit open"):
+        race(failing=("openai",))
+
+
+def test_both_open_keeps_the_normal_order(breakers):
+    for breaker in breakers.values():
+        breaker.open()
+    assert race() == (("openai", "openai"), ["openai"])
+    assert race(use_fallback=True) == (("ollama", "ollama"), ["ollama"])
@@ -0,0 +1,82 @@
+"""MMR diversification: near-duplicate removal, adjacent-chunk merging and the passage size bound"""
+
+import numpy as np
+
+import main
+from conftest import HashEmbedder
+
+QUERY = "Can I claim electricity?"
+
+
+def relevant_vector(seed, spread=0.6):
+    """Close to the query (cosine ~0.86) but only ~0.74 similar to other relevant vectors"""
+    query = HashEmbedder().encode([QUERY])[0]
+    query = query / np.linalg.norm(query)
+    noise = np.random.default_rng(seed).standard_normal(query.shape[0]).astype(np.float32)
+    noise -= (noise @ query) * query
+    return (query + spread * noise / np.linalg.norm(noise)).tolist()
+
+
+def add_chunk(doc_id, chunk_index, embedding, text=None):
+    chunk_id = f"{doc_id}_chunk_{chunk_index}"
+    main.write_chunks(
+        [chunk_id], [embedding], [text or f"{doc_id} passage {chunk_index}"],
+        [{"title": doc_id, "category": "Tax", "doc_id": doc_id, "chunk_index": chunk_index}]
+    )
+    return chunk_id
+
+
+def diversified(limit):
+    return main.search_knowledge_base(QUERY, limit=limit, diversify=True)
+
+
+def test_near_duplicates_are_dropped(kb):
+    shared = relevant_vector(1)
+    original = add_chunk("guide", 0, shared)
+    copy = add_chunk("guide-copy", 0, shared)
+    other = add_chunk("rates", 0, relevant_vector(2))
+    
+    ids = [chunk_id for result in diversified(3) for chunk_id in result.get("chunk_ids", [result["id"]])]
+    assert other in ids
+    assert len({original, copy} & set(ids)) == 1
+
+
+def test_adjacent_chunks_merge_into_one_passage(kb):
+    first = add_chunk("guide", 0, relevant_vector(1))
+    second = add_chunk("guide", 1, relevant_vector(2))
+    other = add_chunk("rates", 0, relevant_vector(3))
+    
+    results = diversified(3)
+    assert len(results) == 2
+    merged = next(result for result in results if "chunk_ids" in result)
+    assert merged["chunk_ids"] == [first, second]
+    assert merged["content"] == "guide passage 0\n\nguide passage 1"
+    assert any(result["id"] == other for result in results)
+
+
+def test_merge_chunk_run_trims_overlapping_text():
+    source = "Family day care educators. Keep receipts for five years."
+    spans = [(0, 20), (15, 34), (30, len(source))]  # each chunk overlaps the previous one
+    run = [
+        {"id": f"c{i}", "content": source[start:end], "distance": 0.2 + i / 10, "score": 0.8 - i / 10,
+         "metadata": {"chunk_index": i, "start_offset": start, "end_offset": end}}
+        for i, (start, end) in enumerate(spans)
+    ]
+    
+    merged = main.merge_chunk_run(list(reversed(run)))
+    assert merged["content"] == source
+    assert merged["chunk_ids"] == ["c0", "c1", "c2"]
+    assert merged["distance"] == 0.2 and merged["score"] == 0.8
+
+
+def test_one_document_cannot_fill_the_prompt(kb, monkeypatch):
+    monkeypatch.setattr(main, "DIVERSIFY_MAX_PASSAGE_CHUNKS", 3)
+    # Relevance falls with chunk_index, so MMR picks the chunks in order, each next to the last
+    for chunk_index in range(8):
+        add_chunk("handbook", chunk_index, relevant_vector(chunk_index, spread=0.5 + 0.05 * chunk_index))
+    
+    results = diversified(3)
+    assert len(results) == 3
+    sizes = [len(result.get("chunk_ids", [result["id"]])) for result in results]
+    assert max(sizes) <= 3
+    assert sum(sizes) <= 3 * 3
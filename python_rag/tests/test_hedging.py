@@ -0,0 +1,106 @@
+"""Hedged LLM requests: hedge delay, racing, fallback and latency samples"""
+
+import asyncio
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    """Fake openai (primary) / ollama providers: each returns its name after `delay[name]`
+    seconds, or raises if `fail[name]` is set"""
+    delay = {"openai": 0.0, "ollama": 0.0}
+    fail = {"openai": False, "ollama": False}
+    calls = []
+    
+    def fake(name):
+        async def call(messages, system_prompt):
+            calls.append(name)
+            await asyncio.sleep(delay[name])
+            if fail[name]:
+                raise RuntimeError(f"{name} down")
+            return f"answer from {name}"
+        return call
+    
+    for name in ("openai", "ollama"):
+        monkeypatch.setitem(main.LLM_CALLS, name, fake(name))
+    monkeypatch.setattr(main, "llm_stats", {name: main.ProviderStats(50) for name in ("openai", "ollama")})
+    monkeypatch.setattr(main, "breakers", {name: main.CircuitBreaker(name) for name in ("openai", "ollama")})
+    monkeypatch.setattr(main, "LLM_HEDGING", True)
+    monkeypatch.setattr(main, "HEDGE_DEFAULT_DELAY_MS", 50)
+    return {"delay": delay, "fail": fail, "calls": calls}
+
+
+def reply():
+    prompts = {name: {"messages": [], "system_prompt": ""} for name in ("openai", "ollama")}
+    started = time.perf_counter()
+    content, provider = asyncio.run(main.generate_reply(prompts, use_fallback=False))
+    return content, provider, time.perf_counter() - started
+
+
+def test_hedge_delay_uses_clamped_p95(monkeypatch):
+    monkeypatch.setattr(main, "llm_stats", {"openai": main.ProviderStats(100)})
+    monkeypatch.setattr(main, "HEDGE_MIN_SAMPLES", 20)
+    monkeypatch.setattr(main, "HEDGE_DEFAULT_DELAY_MS", 8000)
+    monkeypatch.setattr(main, "HEDGE_MIN_DELAY_MS", 1000)
+    monkeypatch.setattr(main, "HEDGE_MAX_DELAY_MS", 30000)
+    stats = main.llm_stats["openai"]
+    
+    for _ in range(19):
+        stats.record("successes", 2000)
+    assert main.hedge_delay("openai") == 8.0  # too few samples: default
+    
+    stats.record("successes", 2000)
+    assert main.hedge_delay("openai") == pytest.approx(2.0)
+    
+    stats.latencies.clear()
+    for _ in range(20):
+        stats.record("successes", 100)
+    assert main.hedge_delay("openai") == 1.0  # clamped up to HEDGE_MIN_DELAY_MS
+    
+    stats.latencies.clear()
+    for _ in range(20):
+        stats.record("successes", 90000)
+    assert main.hedge_delay("openai") == 30.0  # clamped down to HEDGE_MAX_DELAY_MS
+    assert main.hedge_delay("openai", first_token=True) == 8.0  # separate first-token window
+
+
+def test_fast_primary_wins_without_hedging(providers):
+    content, provider, _ = reply()
+    assert (content, provider) == ("answer from openai", "openai")
+    assert providers["calls"] == ["openai"]
+    assert main.llm_stats["openai"].counts["hedged"] == 0
+
+
+def test_slow_primary_is_hedged_and_alternate_wins(providers):
+    providers["delay"]["openai"] = 2.0
+    content, provider, elapsed = reply()
+    
+    assert (content, provider) == ("answer from ollama", "ollama")
+    assert providers["calls"] == ["openai", "ollama"]
+    assert elapsed < 1.0
+    openai, ollama = main.llm_stats["openai"], main.llm_stats["ollama"]
+    assert openai.counts["hedged"] == 1 and openai.counts["cancelled"] == 1
+    assert ollama.counts["wins"] == 1
+    # The cancelled attempt keeps its elapsed time (at least the hedge delay) as a latency sample
+    assert len(openai.latencies) == 1 and openai.latencies[0] >= 50
+
+
+def test_failed_primary_falls_back_immediately(providers, monkeypatch):
+    monkeypatch.setattr(main, "HEDGE_DEFAULT_DELAY_MS", 5000)
+    providers["fail"]["openai"] = True
+    content, provider, elapsed = reply()
+    
+    assert (content, provider) == ("answer from ollama", "ollama")
+    assert elapsed < 1.0
+    assert main.llm_stats["openai"].counts["failures"] == 1
+    assert main.llm_stats["openai"].counts["hedged"] == 0
+
+
+def test_both_providers_failing_raises(providers):
+    providers["fail"]["openai"] = providers["fail"]["ollama"] = True
+    with pytest.raises(Exception, match="Both LLMs failed. openai: openai down, ollama: ollama down"):
+        reply()
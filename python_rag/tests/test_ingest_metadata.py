@@ -0,0 +1,40 @@
+"""Chunk metadata written by ingest_text: re-ingest updates and reserved keys"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+def test_reingest_removes_dropped_metadata_key(kb):
+    content = "Family day care educators can claim the business portion of electricity."
+    first = main.ingest_text(
+        "Electricity", content, "Tax", metadata={"audience": "educator"}, source_key="docs/electricity.txt"
+    )
+    assert first["status"] == "success"
+    
+    second = main.ingest_text("Electricity", content, "Tax", source_key="docs/electricity.txt")
+    assert second["status"] == "success"
+    assert second["chunks_reused"] == first["chunks_created"]
+    
+    stored = kb.get(include=["metadatas"])
+    assert stored["metadatas"] and all("audience" not in meta for meta in stored["metadatas"])
+    assert all("audience" not in meta for meta in main.exact_index.metadatas)
+    assert not kb.get(where={"audience": "educator"})["ids"]
+    
+    third = main.ingest_text("Electricity", content, "Tax", source_key="docs/electricity.txt")
+    assert third["status"] == "unchanged"
+
+
+@pytest.mark.parametrize("key", ["doc_id", "content_hash", "source_key"])
+def test_ingest_rejects_reserved_metadata_keys(kb, key):
+    with pytest.raises(ValueError, match=key):
+        main.ingest_text("Electricity", "Some content.", "Tax", metadata={key: "caller-value"})
+    assert kb.count() == 0
+    
+    request = main.DocumentIngest(title="Electricity", content="Some content.", category="Tax", metadata={key: "x"})
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.ingest_document(request))
+    assert error.value.status_code == 400
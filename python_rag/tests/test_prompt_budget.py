@@ -0,0 +1,102 @@
+"""Prompt budget: what fit_prompt keeps, drops and summarises"""
+
+import pytest
+
+import main
+
+RULEBOOK = "Never give advice outside Australian tax law."
+QUESTION_WORDS = " ".join(["detail"] * 8)
+
+
+def words(text, provider):
+    return len(text.split())
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    """Count a token per word so budgets are easy to reason about (and no encodings are downloaded)"""
+    monkeypatch.setattr(main, "count_tokens", words)
+    monkeypatch.setitem(main.token_encoders, "openai", None)
+    monkeypatch.setattr(main, "HISTORY_SUMMARY_TOKENS", 40)
+
+
+def conversation(turns):
+    """`turns` question/answer pairs, then the latest question; every message costs 14 tokens"""
+    messages = []
+    for i in range(1, turns + 1):
+        messages.append({"role": "user", "content": f"question{i} {QUESTION_WORDS} ?"})
+        messages.append({"role": "assistant", "content": f"answer{i} {QUESTION_WORDS} ."})
+    messages.append({"role": "user", "content": f"question{turns + 1} {QUESTION_WORDS} ?"})
+    return messages
+
+
+def kb_result(title, n_words):
+    return {"content": " ".join([title.lower()] * n_words), "metadata": {"title": title, "category": "Tax"}}
+
+
+def fit(monkeypatch, room, messages, kb_results=()):
+    """fit_prompt with `room` tokens to spare after the instructions, rulebook and latest message"""
+    static = words(main.build_system_prompt("internal", RULEBOOK, "", ""), "openai")
+    monkeypatch.setattr(main, "OPENAI_PROMPT_BUDGET", static + 14 + room)
+    return main.fit_prompt("openai", "internal", RULEBOOK, list(kb_results), "", "", messages)
+
+
+def test_rulebook_instructions_and_latest_message_are_always_kept(monkeypatch):
+    messages = conversation(2)
+    fitted = fit(monkeypatch, -100, messages, [kb_result("Deductions", 20)])
+    
+    assert RULEBOOK in fitted["system_prompt"] and "You are Luna" in fitted["system_prompt"]
+    assert fitted["messages"] == messages[-1:]
+    assert fitted["kb_sources"] == []
+    assert fitted["tokens"]["over_budget"] is True
+    assert fitted["tokens"]["tokenizer"] == "estimate"
+
+
+def test_kb_chunks_are_added_in_rank_order_until_the_budget_is_hit(monkeypatch):
+    kb_results = [kb_result("First", 10), kb_result("Second", 100), kb_result("Third", 10)]
+    fitted = fit(monkeypatch, 60, conversation(0), kb_results)
+    
+    # "Third" would fit on its own, but nothing is added after the first chunk that does not
+    assert fitted["kb_sources"] == [{"title": "First", "category": "Tax"}]
+    assert "first first" in fitted["system_prompt"] and "third third" not in fitted["system_prompt"]
+    assert fitted["tokens"]["kb_chunks"] == 1 and fitted["tokens"]["kb_chunks_dropped"] == 2
+    
+    fitted = fit(monkeypatch, 1000, conversation(0), kb_results)
+    assert [source["title"] for source in fitted["kb_sources"]] == ["First", "Second", "Third"]
+    prompt = fitted["system_prompt"]
+    assert prompt.index("1. First") < prompt.index("2. Second") < prompt.index("3. Third")
+
+
+def test_history_fills_newest_first_and_summarises_dropped_questions(monkeypatch):
+    messages = conversation(3)
+    # Room for two earlier messages plus the summary reserve
+    fitted = fit(monkeypatch, 2 * 14 + 40 + 5, messages)
+    
+    assert fitted["messages"] == messages[-3:]
+    tokens = fitted["tokens"]
+    assert tokens["history_messages"] == 3 and tokens["history_trimmed"] == 4
+    assert tokens["history"] == 3 * 14
+    assert tokens["history_summary"] > 0
+    summary = fitted["system_prompt"].split("Earlier in this conversation (trimmed to fit), the user asked:")[1]
+    assert summary == f"\n- question1 {QUESTION_WORDS} ?\n- question2 {QUESTION_WORDS} ?"
+    assert tokens["total"] <= tokens["budget"]
+
+
+def test_trimmed_history_does_not_start_with_an_orphaned_answer(monkeypatch):
+    messages = conversation(4)
+    # Room for three earlier messages: answer3 would be kept without question3
+    fitted = fit(monkeypatch, 3 * 14 + 40 + 5, messages)
+    
+    assert fitted["messages"] == messages[-3:]
+    assert fitted["messages"][0]["role"] == "user"
+    assert fitted["tokens"]["history"] == 3 * 14
+    assert fitted["tokens"]["history_trimmed"] == 6
+
+
+def test_history_that_fits_is_kept_whole(monkeypatch):
+    messages = conversation(3)
+    fitted = fit(monkeypatch, 6 * 14, messages)
+    
+    assert fitted["messages"] == messages
+    assert fitted["tokens"]["history_trimmed"] == 0 and fitted["tokens"]["history_summary"] == 0
+    assert "Earlier in this conversation" not in fitted["system_prompt"]
@@ -0,0 +1,58 @@
+"""Rebuilding the in-process search indexes must not lose writes made while ChromaDB is copied"""
+
+import main
+from conftest import HashEmbedder
+
+
+class WriteDuringCopy:
+    """Collection proxy that runs a write once the exact index copy has read the last page"""
+    
+    def __init__(self, collection, write):
+        self.collection = collection
+        self.write = write
+    
+    def get(self, **kwargs):
+        page = self.collection.get(**kwargs)
+        if not page["ids"] and "embeddings" in kwargs.get("include", ()) and self.write:
+            write, self.write = self.write, None
+            write()
+        return page
+    
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def write_chunk(i):
+    text = f"Chunk {i} about deductible expenses"
+    main.write_chunks([f"chunk_{i}"], HashEmbedder().encode([text]).tolist(), [text], [{"title": f"Doc {i}"}])
+
+
+def test_rebuild_replays_concurrent_writes(kb, monkeypatch):
+    for i in range(5):
+        write_chunk(i)
+    monkeypatch.setattr(main, "SEARCH_ENGINE", "exact")
+    monkeypatch.setattr(main, "kb_collection", WriteDuringCopy(kb, lambda: write_chunk(5)))
+    
+    main.build_search_indexes()
+    
+    assert kb.count() == 6
+    assert main.lexical_index.stats()["chunks"] == 6
+    assert main.exact_index.stats()["chunks"] == 6
+    assert main.index_write_journal is None
+
+
+def test_rebuild_replays_concurrent_deletes(kb, monkeypatch):
+    for i in range(5):
+        write_chunk(i)
+    
+    def delete_chunk():
+        kb.delete(ids=["chunk_0"])
+        main.unindex_chunks(["chunk_0"])
+    
+    monkeypatch.setattr(main, "SEARCH_ENGINE", "exact")
+    monkeypatch.setattr(main, "kb_collection", WriteDuringCopy(kb, delete_chunk))
+    
+    main.build_search_indexes()
+    
+    assert main.lexical_index.stats()["chunks"] == 4
+    assert "chunk_0" not in main.exact_index.rows
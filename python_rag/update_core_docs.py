@@ -3,10 +3,14 @@
 Update specific documents to be marked as 'Core' in ChromaDB
 """
 
+import os
+from pathlib import Path
+
 import chromadb
 
 # Initialize ChromaDB
-chroma_client = chromadb.PersistentClient(path="/app/python_rag/chroma_db")
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", str(Path(__file__).resolve().parent / "chroma_db"))
+chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
 kb_collection = chroma_client.get_collection(name="fdc_knowledge_base")
 
 # Documents to mark as Core
@@ -38,3 +42,6 @@ for doc_id in CORE_DOCS:
     print(f"✅ Updated {len(results['ids'])} chunks for doc {doc_id} to Core category")
 
 print("\n✅ Core documents updated successfully!")
+
+# Tell the running server(s) to drop cached answers and rebuild the Core rulebook
+(Path(CHROMA_DB_PATH) / "kb_changed").touch()
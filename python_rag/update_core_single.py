@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
+import os
+from pathlib import Path
+
 import chromadb
 
-chroma_client = chromadb.PersistentClient(path="/app/python_rag/chroma_db")
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", str(Path(__file__).resolve().parent / "chroma_db"))
+chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
 kb_collection = chroma_client.get_collection(name="fdc_knowledge_base")
 
 # Find Luna Style Guide by title
@@ -22,3 +26,6 @@ for i, metadata in enumerate(all_results['metadatas']):
         
         print(f"✅ Updated {len(doc_results['ids'])} chunks to Core category")
         break
+
+# Tell the running server(s) to drop cached answers and rebuild the Core rulebook
+(Path(CHROMA_DB_PATH) / "kb_changed").touch()